@@ -11,23 +11,38 @@ __version__ =     '0.1'
 __url__ =         'https://github.com/ASPP/grader'
 __author__ =      'grader contributor'
 __license__ =     'GPLv3+'
+# the git revision is looked up by revision(), git is slow to start
 __revision__ =    'N/A'
 
-# get the git SHA if we are in a git repo (only useful for devs)
-
 # current dir
 CWD = os.path.abspath(os.path.dirname(__file__))
-# try two options for getting the git revision
-# - nice version with tags
-# - plain SHA
-for cmd in ('git describe --tags --dirty=+'), ('git rev-parse HEAD'):
-    try:
-        proc = subprocess.check_output(cmd.split(), cwd=CWD,
-                stderr=subprocess.PIPE, universal_newlines=True)
-        __revision__ = proc.strip()
-    except Exception:
-        # ok, don't bother
-        pass
+
+def _git_revision():
+    """Return the git SHA if we are in a git repo (only useful for devs)
+
+    Try two options for getting the git revision:
+    - nice version with tags
+    - plain SHA
+    """
+    for cmd in ('git describe --tags --dirty=+'), ('git rev-parse HEAD'):
+        try:
+            proc = subprocess.check_output(cmd.split(), cwd=CWD,
+                    stderr=subprocess.PIPE, universal_newlines=True)
+            return proc.strip()
+        except Exception:
+            # ok, don't bother
+            pass
+    return 'N/A'
+
+def revision():
+    "Return the git revision, and keep it in __revision__"
+    global __revision__, _revision_done
+    if not _revision_done:
+        __revision__ = _git_revision()
+        _revision_done = True
+    return __revision__
+
+_revision_done = False
 
 # have a way to test from python
 def test():
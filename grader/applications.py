@@ -1,8 +1,19 @@
+import ast
+import codecs
 import collections
 import csv
+import functools
+import hashlib
+import io
 import itertools
+import mmap
 import os
+import pickle
 import pprint
+import re
+import sys
+
+import numpy as np
 
 from . import vector
 from .util import (
@@ -13,36 +24,266 @@ from .util import (
 )
 
 
-def build_person_factory(fields):
-    class Person(collections.namedtuple('Person', fields)):
-        def __init__(self, *args, **kwargs):
-            # tuple fields are already set in __new__
-            self.score = None
-            self.rank = None
-            self.highlander = None
-            self.samelab = False
-            self.labels = list_of_str()
-            try:
-                # manually set applied and napplied attributes,
-                # in case this is the first time we run the school
-                # and there are no old applications laying around
-                self.napplied = 0
-                self.applied = 'N'
-            except AttributeError:
-                # we get an "AttributeError: can't set attribute"
-                # if the attributes are set already
-                pass
-
-        @property
-        def fullname(self):
-            return '{p.name} {p.lastname}'.format(p=self)
-
-        @property
-        def nonmale(self):
-            "Return true if gender is 'female' or 'other'"
-            return self.gender.lower() != 'male'
-
-    return Person
+# free-text fields which can be left on disk until needed
+LAZY_TEXT_FIELDS = ('cv', 'motivation',
+                    'programming_description', 'open_source_description')
+
+class CSVSource:
+    """A CSV file on disk, from which single records can be read again
+
+    The file is memory-mapped on first use, so reading a record is a slice
+    of the map. The last record is kept decoded, because it is usually
+    needed for several fields in a row.
+    """
+    def __init__(self, path, dialect):
+        self.path = path
+        # keep plain parameters and not the dialect class, so we can be pickled
+        self.fmtparams = {name:getattr(dialect, name)
+                          for name in ('delimiter', 'quotechar', 'escapechar',
+                                       'doublequote', 'skipinitialspace',
+                                       'quoting', 'lineterminator')}
+        self._map = None
+        self._stat = None
+        self._last = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_map=None, _stat=None, _last=None)
+        return state
+
+    def _mapped(self):
+        stat = os.stat(self.path)
+        stat = stat.st_size, stat.st_mtime_ns
+        if self._map is None:
+            with open(self.path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._stat = stat
+        elif stat != self._stat:
+            # reading from a map of a truncated file would crash us
+            raise ValueError('{} changed since it was loaded'.format(self.path))
+        return self._map
+
+    def record(self, start, end):
+        "Return the fields of the record at bytes start:end"
+        data = self._mapped()
+        if self._last is not None and self._last[0] == start:
+            return self._last[1]
+        text = data[start:end].decode('utf-8')
+        fields = next(csv.reader(io.StringIO(text, newline=''), **self.fmtparams))
+        self._last = start, fields
+        return fields
+
+class LazyRecord:
+    """A CSV record, whose fields are only read from the file when needed
+
+    All lazy fields of a person share one LazyRecord.
+    """
+    __slots__ = ('source', 'start', 'end')
+
+    def __init__(self, source, start, end):
+        self.source = source
+        self.start = start
+        self.end = end
+
+    def field(self, column):
+        return self.source.record(self.start, self.end)[column]
+
+def _lazy_field(slot, column):
+    def get(self):
+        value = getattr(self, slot)
+        return value.field(column) if isinstance(value, LazyRecord) else value
+    return property(get)
+
+# attributes of a person which do not come from the CSV file
+EXTRA_ATTRIBUTES = ('score', 'rank', 'highlander', 'samelab', 'labels',
+                    'napplied', 'applied')
+
+# fields with a handful of distinct values: equal values share one string
+CATEGORICAL_FIELDS = ('gender', 'nationality', 'affiliation', 'position',
+                      'python', 'programming', 'vcs', 'open_source',
+                      'underrep', 'applied', 'born', 'institute', 'group')
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+class _Person:
+    """An applicant: the fields from the CSV file and the grader state
+
+    Behaves like the namedtuple used before (_fields, iteration,
+    indexing, equality by value), but everything lives in slots,
+    so that a person does not carry a __dict__.
+    """
+    __slots__ = ('score', 'rank', 'highlander', 'samelab', 'labels',
+                 'napplied')
+    _fields = ()
+    _lazy_fields = ()
+    _slots = ()          # the slot holding each field
+    _categorical = ()    # the positions of fields to intern
+
+    def __init__(self, *args, **kwargs):
+        if kwargs or len(args) != len(self._fields):
+            args = self._arguments(args, kwargs)
+        self.score = None
+        self.rank = None
+        self.highlander = None
+        self.samelab = False
+        self.labels = list_of_str()
+        # in case this is the first time we run the school
+        # and there are no old applications laying around;
+        # overwritten below if applied is a field
+        self.napplied = 0
+        self.applied = 'N'
+        for slot, value in zip(self._slots, args):
+            setattr(self, slot, value)
+        for i in self._categorical:
+            setattr(self, self._slots[i], _intern(args[i]))
+
+    @classmethod
+    def _arguments(cls, args, kwargs):
+        if len(args) > len(cls._fields):
+            raise TypeError('{}() takes {} arguments, {} given'.format(
+                cls.__name__, len(cls._fields), len(args)))
+        values = dict(zip(cls._fields, args))
+        for name, value in kwargs.items():
+            if name not in cls._fields or name in values:
+                raise TypeError('{}() got an unexpected or repeated argument {!r}'
+                                .format(cls.__name__, name))
+            values[name] = value
+        missing = [name for name in cls._fields if name not in values]
+        if missing:
+            raise TypeError('{}() missing arguments: {}'.format(
+                cls.__name__, ', '.join(missing)))
+        return [values[name] for name in cls._fields]
+
+    def _raw(self):
+        "Return the field values, with lazy fields not read"
+        return tuple(getattr(self, slot) for slot in self._slots)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._raw() == other._raw()
+
+    def __hash__(self):
+        return hash(self._raw())
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(name, getattr(self, name))
+            for name in self._fields))
+
+    @property
+    def fullname(self):
+        return '{p.name} {p.lastname}'.format(p=self)
+
+    @property
+    def nonmale(self):
+        "Return true if gender is 'female' or 'other'"
+        return self.gender.lower() != 'male'
+
+def build_person_factory(fields, lazy_fields=()):
+    fields = tuple(fields)
+    # fields which may hold a LazyRecord live in a private slot
+    # and are read through a property
+    slots = tuple('_' + name if name in lazy_fields else name
+                  for name in fields)
+    namespace = dict(
+        __slots__=slots + (() if 'applied' in fields else ('applied',)),
+        _fields=fields,
+        _lazy_fields=tuple(lazy_fields),
+        _slots=slots,
+        _categorical=tuple(i for i, name in enumerate(fields)
+                           if name in CATEGORICAL_FIELDS),
+    )
+    for column, name in enumerate(fields):
+        if name in lazy_fields:
+            namespace[name] = _lazy_field(slots[column], column)
+    return type('Person', (_Person,), namespace)
+
+class HeaderMatcher:
+    """col_name_to_field for one [fields] mapping, with the work done upfront
+
+    Exact matches are found in a dictionary. The spellings which occur
+    in a description are found with one regular expression: at each
+    position the longest spelling starting there is matched, and every
+    spelling which is a prefix of it occurs too. Results are remembered,
+    because editions share most of their headers.
+    """
+
+    def __init__(self, fields_to_col_names):
+        # (text, lowercased?) -> position of the first key matching exactly
+        self._exact = {}
+        # spelling -> keys with this spelling
+        self._keys = collections.defaultdict(list)
+        for i, (key, values) in enumerate(fields_to_col_names):
+            self._exact.setdefault((key, True), i)
+            values = [spelling for spelling in values if spelling != '']
+            for j, spelling in enumerate(values):
+                # col_name_to_field stops at the first spelling contained in
+                # the description, so only that one can match exactly
+                if not any(earlier in spelling for earlier in values[:j]):
+                    self._exact.setdefault((spelling, False), i)
+                self._keys[spelling].append(key)
+        self._names = [key for key, _ in fields_to_col_names]
+        spellings = sorted(self._keys, key=len, reverse=True)
+        self._prefixes = {spelling: [other for other in spellings
+                                     if spelling.startswith(other)]
+                          for spelling in spellings}
+        self._pattern = re.compile('(?=({}))'.format(
+            '|'.join(re.escape(spelling) for spelling in spellings))
+                                   ) if spellings else None
+        self._memo = {}
+
+    def __call__(self, description):
+        try:
+            return self._memo[description]
+        except KeyError:
+            pass
+        key = self._memo[description] = self._match(description)
+        return key
+
+    def _match(self, description):
+        if description[0] == description[-1] == '"':
+            # why this doesn't get stripped automatically is beyond me
+            description = description[1:-1]
+
+        # Recent versions of limesurvey set the descriptions as "KEY. Blah
+        # blah" or "KEY[other]. Blah blah". Let's match the first part only.
+        desc, _, _ = description.partition('.')
+
+        exact = [self._exact[text] for text in ((desc.lower(), True), (desc, False))
+                 if text in self._exact]
+        if exact:
+            return self._names[min(exact)]
+
+        candidates = set()
+        if self._pattern is not None:
+            for match in self._pattern.finditer(desc):
+                for spelling in self._prefixes[match.group(1)]:
+                    candidates.update(self._keys[spelling])
+        if len(candidates) == 1:
+            return candidates.pop()
+        if len(candidates) > 1:
+            print(f'TOO MANY CANDIDATES for {description}: {candidates}')
+        raise KeyError(description)
+
+@functools.lru_cache(maxsize=16)
+def _header_matcher(fields_to_col_names):
+    return HeaderMatcher(fields_to_col_names)
+
+def header_matcher(fields_to_col_names):
+    "Return the HeaderMatcher for this mapping, shared by all editions"
+    return _header_matcher(tuple((key, tuple(values))
+                                 for key, values in fields_to_col_names.items()))
 
 def col_name_to_field(description, fields_to_col_names):
     """Return the name of a field for this description. Must be defined.
@@ -51,42 +292,24 @@ def col_name_to_field(description, fields_to_col_names):
     - position <=> position,
     - [other] position <=> position_other,
     - curriculum vitae <=> Please type in a short curriculum vitae...
+
+    The first key equal to the lowercased description, or with a
+    spelling equal to it, wins. Otherwise there must be exactly one key
+    with a spelling contained in the description.
     """
-    if description[0] == description[-1] == '"':
-        # why this doesn't get stripped automatically is beyond me
-        description = description[1:-1]
-
-    # Recent versions of limesurvey set the descriptions as "KEY. Blah
-    # blah" or "KEY[other]. Blah blah". Let's match the first part only.
-    desc, _, _ = description.partition('.')
-
-    candidates = set()
-    for key, values in fields_to_col_names.items():
-        if desc.lower() == key:
-            return key
-        for spelling in values:
-            if spelling == '':
-                continue
-            if desc == spelling:
-                return key
-            if spelling in desc:
-                candidates.add(key)
-                break # don't try other spellings for the same key
-    if len(candidates) == 1:
-        return candidates.pop()
-    if len(candidates) > 1:
-        print(f'TOO MANY CANDIDATES for {description}: {candidates}')
-    raise KeyError(description)
+    return header_matcher(fields_to_col_names)(description)
 
 @vector.vectorize
-def csv_header_to_fields(header, fields_to_col_names_section):
-    pprint.pprint(list(fields_to_col_names_section.items()))
+def csv_header_to_fields(header, fields_to_col_names_section, verbose=False):
+    if verbose:
+        pprint.pprint(list(fields_to_col_names_section.items()))
 
+    match = header_matcher(fields_to_col_names_section)
     failed = None
     seen = {}
     for name in header:
         try:
-            conv = col_name_to_field(name, fields_to_col_names_section)
+            conv = match(name)
             if conv in seen:
                 raise ValueError(f'Both "{name}" and "{seen[conv]}" map to "{conv}".')
             seen[conv] = name
@@ -95,27 +318,122 @@ def csv_header_to_fields(header, fields_to_col_names_section):
             printf(f"unknown field: '{name}'")
             failed = e
     if failed:
+        if not verbose:
+            pprint.pprint(list(fields_to_col_names_section.items()))
         raise failed
 
-@vector.vectorize
-def parse_applications_csv_file(file, fields_to_col_names_section):
-    printf("loading '{}'", file.name)
+class _OffsetLines:
+    "Decoded lines of a binary file, which remembers where the last line ended"
+    def __init__(self, file):
+        self.file = file
+        self.offset = file.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.file.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode('utf-8')
+
+class LimeSurveyDialect(csv.excel):
+    "The CSV exports of LimeSurvey: comma separated, every field in double quotes"
+
+# what is remembered of a dialect, the rest is as in csv.excel
+DIALECT_ATTRIBUTES = ('delimiter', 'quotechar', 'skipinitialspace')
+
+def dialect_to_str(dialect):
+    "Return a string for the config file, which dialect_from_str reads back"
+    values = tuple(getattr(dialect, name) for name in DIALECT_ATTRIBUTES)
+    if values == tuple(getattr(LimeSurveyDialect, name)
+                       for name in DIALECT_ATTRIBUTES):
+        return 'limesurvey'
+    return repr(values)
+
+def dialect_from_str(text):
+    "Return the dialect saved by dialect_to_str, raise ValueError if invalid"
+    if text == 'limesurvey':
+        return LimeSurveyDialect
+    try:
+        delimiter, quotechar, skipinitialspace = ast.literal_eval(text)
+    except (ValueError, TypeError, SyntaxError):
+        raise ValueError('invalid CSV dialect: {}'.format(text)) from None
+    dialect = type('SavedDialect', (csv.excel,),
+                   dict(delimiter=delimiter, quotechar=quotechar,
+                        skipinitialspace=skipinitialspace))
+    # let the csv module check the values
+    csv.reader([], dialect=dialect)
+    return dialect
+
+def _is_limesurvey_header(line):
+    line = line.rstrip('\r\n')
+    return (line.startswith('"') and line.endswith('"') and
+            '","' in line and '";"' not in line and '"\t"' not in line)
+
+def detect_csv_dialect(sample):
+    """Return the dialect of a CSV file beginning with sample
+
+    LimeSurvey exports are recognized from the header line, the others
+    go through the (slow) csv.Sniffer.
+    """
+    if _is_limesurvey_header(sample.partition('\n')[0]):
+        return LimeSurveyDialect
     # let's try to detect the separator
-    csv_dialect = csv.Sniffer().sniff(file.read(32768))
+    csv_dialect = csv.Sniffer().sniff(sample)
     # manually set doublequote (the sniffer doesn't get it automatically)
     csv_dialect.doublequote = True
-    # rewind
-    file.seek(0)
+    return csv_dialect
+
+def _read_sample(file):
+    "Return the beginning of a file, skipping the byte order mark"
+    if file.read(len(codecs.BOM_UTF8)) != codecs.BOM_UTF8:
+        file.seek(0)
+    return file.read(32768).decode('utf-8', errors='ignore')
+
+def iter_applications_csv_file(file, fields_to_col_names_section, lazy_fields=(),
+                               dialect=None):
+    """Yield applicants from file one at a time
+
+    file is opened either in text mode with newline='', or in binary mode.
+    With a binary file, the fields listed in lazy_fields are not kept in
+    memory, but read again from the file when they are accessed.
+    The CSV dialect is detected, unless given.
+    """
+    printf("loading '{}'", file.name)
+    binary = not isinstance(file, io.TextIOBase)
+    if binary:
+        # skip the byte order mark, like the utf-8-sig encoding does
+        if file.read(len(codecs.BOM_UTF8)) != codecs.BOM_UTF8:
+            file.seek(0)
+        begin = file.tell()
+        if dialect is None:
+            sample = file.read(32768).decode('utf-8', errors='ignore')
+            file.seek(begin)
+        lines = _OffsetLines(file)
+    elif lazy_fields:
+        raise ValueError('lazy fields need a file opened in binary mode')
+    else:
+        if dialect is None:
+            sample = file.read(32768)
+            file.seek(0)
+        lines = file
+    csv_dialect = dialect if dialect is not None else detect_csv_dialect(sample)
     # now the CSV reader should be setup
-    reader = csv.reader(file, dialect=csv_dialect)
+    reader = csv.reader(lines, dialect=csv_dialect)
     csv_header = next(reader)
     fields = csv_header_to_fields(csv_header, fields_to_col_names_section)
     assert len(fields) == len(csv_header)      # sanity check
     assert len(set(fields)) == len(csv_header) # two columns map to the same field
-    person_factory = build_person_factory(fields)
+    lazy_fields = [field for field in fields if field in lazy_fields]
+    lazy_columns = [fields.index(field) for field in lazy_fields]
+    person_factory = build_person_factory(fields, lazy_fields)
     assert len(csv_header) == len(person_factory._fields)
+    source = CSVSource(file.name, csv_dialect) if lazy_fields else None
     count = 0
     while True:
+        start = lines.offset if binary else None
         try:
             entry = next(reader)
         except StopIteration:
@@ -124,6 +442,11 @@ def parse_applications_csv_file(file, fields_to_col_names_section):
             # skip empty line
             continue
         count += 1
+        if lazy_columns:
+            record = LazyRecord(source, start, lines.offset)
+            for column in lazy_columns:
+                if entry[column]:
+                    entry[column] = record
         try:
             yield person_factory(*entry)
         except Exception as exp:
@@ -131,12 +454,250 @@ def parse_applications_csv_file(file, fields_to_col_names_section):
             print('Detected fields:', fields)
             import pdb; pdb.set_trace()
 
+@vector.vectorize
+def parse_applications_csv_file(file, fields_to_col_names_section, lazy_fields=(),
+                                dialect=None):
+    yield from iter_applications_csv_file(file, fields_to_col_names_section,
+                                          lazy_fields, dialect)
+
+# bump when the format of the snapshots changes
+SNAPSHOT_VERSION = 3
+
+def _snapshot_key(csv_path, fields_to_col_names_section, lazy_fields, dialect):
+    "Return what must be the same for a snapshot to be valid"
+    stat = os.stat(csv_path)
+    mapping = tuple((key, tuple(values))
+                    for key, values in fields_to_col_names_section.items())
+    dialect = dialect_to_str(dialect) if dialect is not None else None
+    return (SNAPSHOT_VERSION, os.path.abspath(csv_path),
+            stat.st_size, stat.st_mtime_ns, mapping, tuple(lazy_fields), dialect)
+
+def _snapshot_path(cache_dir, csv_path):
+    name = hashlib.sha1(os.path.abspath(csv_path).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, name + '.pickle')
+
+def _load_snapshot(path, key):
+    try:
+        with open(path, 'rb') as f:
+            saved_key, fields, lazy_fields, columns = pickle.load(f)
+    except Exception:
+        # a missing or unreadable snapshot, or one with unexpected contents,
+        # is a cache miss: the CSV file is parsed again
+        return None
+    if saved_key != key:
+        return None
+    person_factory = build_person_factory(fields, lazy_fields)
+    return vector.vector(person_factory(*row) for row in zip(*columns))
+
+def _save_snapshot(path, key, applicants):
+    fields = applicants[0]._fields
+    lazy_fields = applicants[0]._lazy_fields
+    # store by column, repeated values in a column pickle to a reference;
+    # lazy fields are stored as LazyRecord and not read
+    columns = [list(column) for column in zip(*(p._raw() for p in applicants))]
+    tmp = path + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, 'wb') as f:
+            pickle.dump((key, fields, lazy_fields, columns), f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as e:
+        printf('warning: cannot save snapshot of applications: {}', e)
+
+def _csv_file_dialect(csv_path, dialects):
+    "Return the dialect of csv_path from dialects, or detect it and add it there"
+    saved = dialects.get(csv_path, None)
+    if saved:
+        try:
+            return dialect_from_str(saved)
+        except (ValueError, TypeError, csv.Error) as e:
+            printf("warning: {}, detecting the dialect of '{}' again", e, csv_path)
+    with open(csv_path, 'rb') as f:
+        dialect = detect_csv_dialect(_read_sample(f))
+    dialects[csv_path] = dialect_to_str(dialect)
+    return dialect
+
+def load_applications_csv_file(csv_path, fields_to_col_names_section,
+                               cache_dir=None, lazy_fields=(), dialects=None):
+    """Return applicants from the CSV file at csv_path
+
+    If cache_dir is given, a snapshot of the parsed applicants is kept
+    there and used instead of parsing the CSV file again, as long as the
+    file, the field mapping and the dialect did not change.
+
+    Fields in lazy_fields are left in the file until accessed.
+
+    dialects maps paths to dialects saved with dialect_to_str. The
+    dialect of csv_path is taken from there, or detected and added.
+    """
+    # resolved first, so that a corrected dialect invalidates the snapshot
+    dialect = _csv_file_dialect(csv_path, dialects) if dialects is not None else None
+    if cache_dir is not None:
+        key = _snapshot_key(csv_path, fields_to_col_names_section, lazy_fields,
+                            dialect)
+        snapshot = _snapshot_path(cache_dir, csv_path)
+        applicants = _load_snapshot(snapshot, key)
+        if applicants is not None:
+            printf("loading '{}' (snapshot)", csv_path)
+            return applicants
+
+    if lazy_fields:
+        with open(csv_path, 'rb') as f:
+            applicants = parse_applications_csv_file(
+                f, fields_to_col_names_section, lazy_fields, dialect)
+    else:
+        with open(csv_path, newline='', encoding='utf-8-sig') as f:
+            applicants = parse_applications_csv_file(
+                f, fields_to_col_names_section, dialect=dialect)
+
+    if cache_dir is not None and applicants:
+        _save_snapshot(snapshot, key, applicants)
+    return applicants
+
+def stream_applications_csv_file(csv_path, fields_to_col_names_section,
+                                 dialects=None):
+    """Yield applicants from the CSV file at csv_path one at a time
+
+    Nothing is kept in memory, for consumers which look at every applicant
+    once. dialects is used like in load_applications_csv_file.
+    """
+    dialect = _csv_file_dialect(csv_path, dialects) if dialects is not None else None
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        yield from iter_applications_csv_file(f, fields_to_col_names_section,
+                                              dialect=dialect)
+
+# numpy types of the columns for the grader state, object otherwise
+DERIVED_DTYPES = {
+    'score': float,
+    'rank': float,
+    'highlander': bool,
+    'samelab': bool,
+    'napplied': int,
+}
+
+def _array(values, dtype, count):
+    """Return an array of count values
+
+    np.fromiter only creates object arrays since numpy 1.23, so those
+    are filled one item at a time instead. Assigning a list to a slice
+    would not do either: lists of equal length (labels) are broadcast.
+    """
+    if dtype is object:
+        array = np.empty(count, dtype=object)
+        for i, value in enumerate(values):
+            array[i] = value
+        return array
+    return np.fromiter(values, dtype=dtype, count=count)
+
+class ApplicantTable:
+    """A columnar view of the applicants: one numpy array per attribute
+
+    Columns of the fields from the CSV file are built on first use and
+    kept, because fields do not change after loading. The attributes set
+    by the grader (score, rank, highlander, napplied, ...) and the derived
+    columns registered with Applications.derive are gathered at every
+    access, so they are never stale. Missing scores and ranks are nan.
+    """
+
+    def __init__(self, applicants, derived=None):
+        self.applicants = applicants
+        self.fields = applicants[0]._fields if applicants else ()
+        self.derived = derived if derived is not None else {}
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.applicants)
+
+    def __contains__(self, name):
+        return (name in self.fields or name in EXTRA_ATTRIBUTES
+                or name in self.derived)
+
+    def names(self):
+        "Return the names of all columns"
+        return (list(self.fields) +
+                [name for name in EXTRA_ATTRIBUTES if name not in self.fields] +
+                list(self.derived))
+
+    def __getitem__(self, name):
+        try:
+            return self._columns[name]
+        except KeyError:
+            pass
+        if name in self.fields:
+            column = self._gather(name)
+            column.flags.writeable = False
+            self._columns[name] = column
+            return column
+        if name in self.derived:
+            return np.asarray(self.derived[name](self))
+        if name in EXTRA_ATTRIBUTES:
+            return self._gather(name)
+        raise KeyError(name)
+
+    def _gather(self, name):
+        dtype = DERIVED_DTYPES.get(name, object)
+        values = (getattr(p, name) for p in self.applicants)
+        if dtype is float:
+            values = (float('nan') if value is None else value for value in values)
+        return _array(values, dtype, len(self.applicants))
+
+    def map(self, name, func, dtype=float, rows=None):
+        "Return func(value) for the values of column name, calling func once per value"
+        column = self[name] if rows is None else self[name][rows]
+        try:
+            values, inverse = np.unique(column, return_inverse=True)
+        except TypeError:
+            # values which cannot be sorted
+            cache = {}
+            return _array((cache[value] if value in cache else
+                           cache.setdefault(value, func(value))
+                           for value in column),
+                          dtype, len(column))
+        mapped = _array((func(value) for value in values), dtype, len(values))
+        return mapped[inverse.reshape(-1)]
+
+    def counts(self, name, rows=None):
+        "Return a Counter of the values of column name, optionally only in rows"
+        column = self[name] if rows is None else self[name][rows]
+        try:
+            values, first, counts = np.unique(column, return_index=True,
+                                              return_counts=True)
+        except TypeError:
+            return collections.Counter(column.tolist())
+        # in order of first appearance, like a Counter filled row by row
+        order = np.argsort(first)
+        return collections.Counter(dict(zip(values[order].tolist(),
+                                            counts[order].tolist())))
+
+    def to_pandas(self, names=None):
+        """Return a pandas.DataFrame with the columns in names (default all)
+
+        The numpy columns are handed over without a copy where pandas can
+        use them as they are.
+        """
+        import pandas
+        names = self.names() if names is None else names
+        return pandas.DataFrame({name: self[name] for name in names}, copy=False)
+
 class Applications:
 
     def __init__(self, applicants, config):
         self.applicants = applicants
         self.config = config
 
+        # case-insensitive lookup tables, the first applicant wins
+        self._by_fullname = {}
+        self._by_email = {}
+        # positions in self.applicants of applicants with a given label
+        self._position = {}
+        self._by_label = collections.defaultdict(set)
+        # built lazily by _attribute_index
+        self._by_attribute = {}
+        # columnar view, built lazily by the table property
+        self._table = None
+        self._derived = {}
+
         if config is not None:
             # Add applicant labels from config file to applicant object
             for applicant in applicants:
@@ -144,6 +705,40 @@ class Applications:
                                               list_of_str())
                 applicant.labels = labels
 
+        for pos, applicant in enumerate(applicants):
+            self._index(applicant, pos)
+
+    def _index(self, applicant, pos):
+        self._by_fullname.setdefault(applicant.fullname.lower(), applicant)
+        email = getattr(applicant, 'email', None)
+        if email:
+            self._by_email.setdefault(email.lower(), applicant)
+        self._position[id(applicant)] = pos
+        for label in applicant.labels:
+            self._by_label[label].add(pos)
+        for attr, index in self._by_attribute.items():
+            index[getattr(applicant, attr)].add(pos)
+
+    def append(self, applicant):
+        """Add an applicant"""
+        if self.config is not None:
+            applicant.labels = self.config['labels'].get(applicant.fullname,
+                                                         list_of_str())
+        self.applicants.append(applicant)
+        self._index(applicant, len(self.applicants) - 1)
+        self._table = None
+
+    @property
+    def table(self):
+        "An ApplicantTable with the same applicants, in the same order"
+        if self._table is None:
+            self._table = ApplicantTable(self.applicants, self._derived)
+        return self._table
+
+    def derive(self, name, func):
+        "Add a column to the table, computed as func(table) at every access"
+        self._derived[name] = func
+
     def __getitem__(self, key):
         """Support basic iteration"""
         return self.applicants[key]
@@ -152,31 +747,48 @@ class Applications:
         return len(self.applicants)
 
     @classmethod
-    def from_paths(cls, config_path, csv_path, fields_to_col_names_section):
+    def from_paths(cls, config_path, csv_path, fields_to_col_names_section,
+                   cache_dir=None, lazy_fields=(), dialects=None):
         if os.path.exists(config_path):
             config = our_configfile(config_path)
         else:
             config = None
             printf('Warning: no configuration file {}', config_path)
 
-        with open(csv_path, newline='', encoding='utf-8-sig') as f:
-            applicants = parse_applications_csv_file(
-                f, fields_to_col_names_section)
+        applicants = load_applications_csv_file(
+            csv_path, fields_to_col_names_section,
+            cache_dir=cache_dir, lazy_fields=lazy_fields, dialects=dialects)
 
         applications = cls(applicants, config)
         return applications
 
+    def index(self, applicant):
+        """Return the position of applicant, like list.index but in O(1)"""
+        try:
+            return self._position[id(applicant)]
+        except KeyError:
+            raise ValueError('Applicant "{}" not in applications'.format(
+                applicant.fullname)) from None
+
     def find_applicant_by_fullname(self, fullname):
-        for applicant in self.applicants:
-            if applicant.fullname.lower() == fullname.lower():
-                return applicant
-        else:
-            raise ValueError('Applicant "{}" not found'.format(fullname))
+        try:
+            return self._by_fullname[fullname.lower()]
+        except KeyError:
+            raise ValueError('Applicant "{}" not found'.format(fullname)) from None
+
+    def find_applicant_by_email(self, email):
+        try:
+            return self._by_email[email.lower()]
+        except KeyError:
+            raise ValueError('Applicant with email "{}" not found'.format(email)) from None
 
     def add_labels(self, fullname, labels):
         # update applicant
         applicant = self.find_applicant_by_fullname(fullname)
         applicant.labels.extend(labels)
+        pos = self._position[id(applicant)]
+        for label in labels:
+            self._by_label[label].add(pos)
         # update config file
         section = self.config['labels']
         saved = section.get(fullname, list_of_str())
@@ -186,19 +798,54 @@ class Applications:
     def clear_labels(self, fullname):
         # update applicant
         applicant = self.find_applicant_by_fullname(fullname)
+        pos = self._position[id(applicant)]
+        for label in applicant.labels:
+            self._by_label[label].discard(pos)
         applicant.labels = []
         # update config file
         self.config['labels'].clear(fullname)
 
+    def _attribute_index(self, attr):
+        """Return a dictionary {value: positions of applicants with attr == value}
+
+        Indices are built on first use and kept, so only attributes which do
+        not change after loading are indexed: the fields from the CSV file
+        and properties derived from them. None is returned for the others.
+        """
+        try:
+            return self._by_attribute[attr]
+        except KeyError:
+            pass
+        if not self.applicants:
+            return None
+        cls = type(self.applicants[0])
+        if not (attr in cls._fields or
+                isinstance(getattr(cls, attr, None), property)):
+            return None
+        index = self._by_attribute[attr] = collections.defaultdict(set)
+        for pos, applicant in enumerate(self.applicants):
+            index[getattr(applicant, attr)].add(pos)
+        return index
+
+    def find_applicants_by_attribute(self, attr, text):
+        """Return applicants whose attribute attr converted to str is text
+
+        This is useful on the command line, where everything is a string.
+        """
+        index = self._attribute_index(attr)
+        if index is None:
+            return [p for p in self.applicants if str(getattr(p, attr)) == text]
+        positions = set().union(*(positions for value, positions in index.items()
+                                  if str(value) == text))
+        return [self.applicants[pos] for pos in sorted(positions)]
+
     def get_labels(self, fullname):
         applicant = self.find_applicant_by_fullname(fullname)
         return applicant.labels
 
     def get_all_labels(self):
-        labels = set()
-        for applicant in self.applicants:
-            labels.update(applicant.labels)
-        return labels
+        return {label for label, positions in self._by_label.items()
+                if positions}
 
     def filter(self, **kwargs):
         """Return an iterator over the applications which match certain criteria:
@@ -225,20 +872,39 @@ class Applications:
         """
         # first match labels
         labels = kwargs.pop('label', None)
+        positions = None
         if labels is not None:
-            matching = []
             labels = iter((labels, )) if type(labels) == str else iter(labels)
             accept = frozenset(itertools.takewhile(lambda x: x!='-', labels))
             deny = frozenset(labels)
-            for p in self.applicants:
-                labels = set(p.labels)
-                if not (accept - labels) and not (labels & deny):
-                    matching.append(p)
-        else:
+            if accept:
+                positions = set.intersection(*(self._by_label.get(label, set())
+                                               for label in accept))
+            else:
+                positions = set(range(len(self.applicants)))
+            for label in deny:
+                positions -= self._by_label.get(label, set())
+
+        # then attributes which can be looked up in an index,
+        # starting with the most selective one
+        scan = []
+        candidates = []
+        for attr, value in kwargs.items():
+            index = self._attribute_index(attr)
+            if index is None:
+                scan.append((attr, value))
+            else:
+                candidates.append(index.get(value, set()))
+        for found in sorted(candidates, key=len):
+            positions = found & positions if positions is not None else set(found)
+
+        if positions is None:
             matching = self.applicants[:]
+        else:
+            matching = [self.applicants[pos] for pos in sorted(positions)]
 
-        # now filter through attributes
-        for attr, value in kwargs.items():
+        # finally filter through the remaining attributes
+        for attr, value in scan:
             matching = [p for p in matching if getattr(p, attr) == value]
 
         return matching
@@ -1,4 +1,5 @@
 import configparser
+import copy
 import operator
 import collections
 
@@ -7,19 +8,35 @@ class _Section:
         self.cp = configparser
         self.section = section
         self.type = type
+        # bumped on every modification, so users can tell cheaply
+        # whether anything changed since they last looked
+        self.version = 0
+        # converted values, filled on first access and written through
+        self._cache = None
+
+    def _values(self):
+        if self._cache is None:
+            self._cache = {name:self.type(value)
+                           for name, value in self.cp.items(self.section)}
+        return self._cache
+
+    @staticmethod
+    def _copy(value):
+        # do not let callers modify our cached lists in place
+        return copy.copy(value) if isinstance(value, list) else value
 
     def __getitem__(self, item):
         try:
-            value = self.cp.get(self.section, item)
-        except configparser.NoOptionError:
-            value = None
-        if value is None:
-            raise KeyError(item)
-        value = self.type(value)
-        return value
+            value = self._values()[self.cp.optionxform(item)]
+        except KeyError:
+            raise KeyError(item) from None
+        return self._copy(value)
 
     def __setitem__(self, item, value):
         self.cp.set(self.section, item, str(value))
+        self._values()[self.cp.optionxform(item)] = \
+            self.type(self.cp.get(self.section, item))
+        self.version += 1
 
     def get(self, item, fallback):
         try:
@@ -38,20 +55,21 @@ class _Section:
             return value
 
     def clear(self, *keys):
-        for key in keys or self.keys():
+        for key in keys or list(self.keys()):
             self.cp.remove_option(self.section, key)
+            self._values().pop(self.cp.optionxform(key), None)
+        self.version += 1
 
     def keys(self):
-        for name, value in self.cp.items(self.section):
-            yield name
+        yield from list(self._values())
 
     def values(self):
-        for name, value in self.cp.items(self.section):
-            yield self.type(value)
+        for value in list(self._values().values()):
+            yield self._copy(value)
 
     def items(self):
-        for name, value in self.cp.items(self.section):
-            yield name, self.type(value)
+        for name, value in list(self._values().items()):
+            yield name, self._copy(value)
 
     def print_sorted(self):
         for key, val in sorted(self.items(), key=operator.itemgetter(1)):
@@ -1,6 +1,11 @@
 #!/usr/bin/env python3
+import argparse
+import ast
+import bisect
 import collections
+import concurrent.futures
 import contextlib
+import functools
 import io
 import itertools
 import keyword
@@ -19,18 +24,17 @@ import textwrap
 import token
 import tokenize
 import traceback
-try:
-    import pandas
-except ImportError:
-    pandas = None
 
+from . import __version__, revision
 from . import cmd_completer
 from .flags import flags as FLAGS
 from . import vector
 
 from .applications import (
-    parse_applications_csv_file,
+    load_applications_csv_file,
+    stream_applications_csv_file,
     Applications,
+    LAZY_TEXT_FIELDS,
 )
 from .util import (
     list_of_equivs,
@@ -51,6 +55,10 @@ def Umask(umask):
     finally:
         os.umask(old)
 
+def _normalized(s):
+    "Lowercase s and collapse whitespace, for comparing names and emails"
+    return ' '.join(s.lower().split())
+
 def ellipsize(s, width):
     return s if len(s) <= width else s[:width-1] + '…'
 
@@ -149,6 +157,14 @@ COUNTRY_WIDTH = 10
 
 NOT_AVAILABLE_LABEL = 'NOT AVAILABLE'
 
+# the attributes counted by stat and wiki
+STAT_OBSERVABLES = ('born', 'gender', 'nationality', 'affiliation',
+                    'position', 'applied', 'napplied', 'open_source',
+                    'programming', 'python', 'vcs', 'underrep')
+
+CACHE_DIR = os.environ.get('GRADER_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'grader'))
+
 
 def equal(a, b):
     # Fuck people who designed this nan != nan crap.
@@ -166,16 +182,32 @@ class Grader(cmd_completer.Cmd_Completer):
     set_completions = cmd_completer.Cmd_Completer.set_completions
     HISTFILE = '~/.grader_history'
 
-    def __init__(self, identity, config, applications):
+    def __init__(self, identity, config, applications, defer_old=False,
+                 cache_dir=None, lazy_text=False):
         super().__init__(histfile=self.HISTFILE)
 
         self.identity = identity
         self.config = config
-        self._init_applications(applications)
+        # where to keep snapshots of parsed applications, None to disable
+        self.cache_dir = cache_dir
+        # free-text fields which are read from the CSV files only when shown
+        self.lazy_fields = LAZY_TEXT_FIELDS if lazy_text else ()
+        self._init_applications(applications, defer_old=defer_old)
         self.modified = False
         self.ranking_done = False
-
-    def _init_applications(self, application_filenames):
+        self._formula_code = None
+        # incremental ranking: scores are recomputed only for persons
+        # in _dirty, unless something in _ranking_key changes
+        self._ranking_state = None
+        self._ranking_order = []
+        self._ranking_keys = {}
+        self._dirty = set()
+        # (version of [equivs], canonicalization table, memoized results)
+        self._equivs = None
+        # {what: (versions of the sections, grades, graded)}
+        self._grades = {}
+
+    def _init_applications(self, application_filenames, defer_old=False):
         section = self.config['application_lists']
         if application_filenames:
             section.clear()
@@ -189,28 +221,82 @@ class Grader(cmd_completer.Cmd_Completer):
             raise ValueError('[fields] section is mandatory')
 
         # Load applications for current edition.
-        with open(application_filenames[0], newline='', encoding='utf-8-sig') as f:
-            applicants = parse_applications_csv_file(
-                f, fields_to_col_names_section)
+        applicants = load_applications_csv_file(
+            application_filenames[0], fields_to_col_names_section,
+            lazy_fields=self.lazy_fields, dialects=self.config['csv_dialects'])
         self.applications = Applications(applicants, self.config)
+        # the ratings of the answers are columns of the applicant table
+        for name in ('programming', 'open_source', 'python', 'vcs', 'underrep'):
+            if name in self.applications.table.fields:
+                self.applications.derive(name + '_rating',
+                                         functools.partial(self._rating_values, name))
+
+        # Applications for previous editions are loaded now, or when
+        # first needed if defer_old is true.
+        self._old_filenames = [filename for filename in application_filenames
+                               if filename != 'applications.csv']
+        self._applications_old = None
+        if not defer_old:
+            self._ensure_old_editions()
+
+    def _rating_values(self, name, table):
+        "Return the rating of the answer to name for each row of table, nan if unrated"
+        rating = self.config[name + '_rating']
+        return table.map(name, lambda value: get_rating(name, rating, value, np.nan))
 
-        # Load applications for previous editions.
-        self.applications_old = {}
-        for filename in application_filenames:
-            if filename == 'applications.csv':
-                continue
+    @property
+    def applications_old(self):
+        self._ensure_old_editions()
+        return self._applications_old
 
+    def _ensure_old_editions(self):
+        "Load applications for previous editions, unless already done"
+        if self._applications_old is not None:
+            return
+        fields_to_col_names_section = self.config['fields']
+        # the dialects are saved in our config file, but written only
+        # from this thread
+        dialects_section = self.config['csv_dialects']
+        dialects = {filename: dialects_section.get(filename, None)
+                    for filename in self._old_filenames}
+
+        def load(filename):
             path = filename.split('/')[0]
             config_path = os.path.join(path, 'grader.conf')
             app = Applications.from_paths(
                 config_path=config_path,
                 csv_path=filename,
                 fields_to_col_names_section=fields_to_col_names_section,
+                cache_dir=self.cache_dir,
+                lazy_fields=self.lazy_fields,
+                dialects=dialects,
             )
-            self.applications_old[path] = app
+            return path, app
 
+        # pool.map returns results in order, so later files for the same
+        # path win, like when loading one after the other
+        with concurrent.futures.ThreadPoolExecutor() as pool:
+            self._applications_old = dict(pool.map(load, self._old_filenames))
+        for filename, dialect in dialects.items():
+            if dialect is not None and dialect != dialects_section.get(filename, None):
+                dialects_section[filename] = dialect
+
+        self._index_old_applications()
         for applicant in self.applications:
             self._set_applied(applicant)
+        # napplied may have changed
+        self.ranking_done = False
+
+    def _index_old_applications(self):
+        "Map names and emails to the previous editions they applied to"
+        self._applied_by_name = collections.defaultdict(set)
+        self._applied_by_email = collections.defaultdict(set)
+        for edition, app_old in self.applications_old.items():
+            for person in app_old:
+                self._applied_by_name[_normalized(person.fullname)].add(edition)
+                email = getattr(person, 'email', '')
+                if email:
+                    self._applied_by_email[_normalized(email)].add(edition)
 
     def _set_applied(self, person):
         "Return the number of times a person applied"
@@ -225,10 +311,9 @@ class Grader(cmd_completer.Cmd_Completer):
         except IndexError:
             person.napplied = 0
             return
-        found = 0
-        for app_old in self.applications_old.values():
-            found += (person.fullname in app_old.applicants.fullname or
-                      person.email in app_old.applicants.email)
+        editions = (self._applied_by_name.get(_normalized(person.fullname), set()) |
+                    self._applied_by_email.get(_normalized(person.email), set()))
+        found = len(editions)
         if found and not declared:
             printf('warning: person found in list says not applied prev.: {}',
                    person.fullname)
@@ -238,6 +323,7 @@ class Grader(cmd_completer.Cmd_Completer):
         person.napplied = max(declared, found)
 
     def _applied_range(self):
+        self._ensure_old_editions()
         s = set(p.napplied for p in self.applications)
         return sorted(s)
 
@@ -250,10 +336,21 @@ class Grader(cmd_completer.Cmd_Completer):
     @formula.setter
     def formula(self, value):
         # check syntax
-        compile(value, '--formula--', 'eval')
+        compile_formula(value)
         self.config['formula']['formula'] = value
-        # invalidate rankings
+        # invalidate rankings and the compiled formula
         self.ranking_done = False
+        self._formula_code = None
+
+    @property
+    def formula_code(self):
+        "The formula compiled to a code object, recompiled only when it changes"
+        formula = self.formula
+        if formula is None:
+            return None
+        if self._formula_code is None or self._formula_code[0] != formula:
+            self._formula_code = formula, compile_formula(formula)
+        return self._formula_code[1]
 
     @property
     def location(self):
@@ -343,6 +440,8 @@ class Grader(cmd_completer.Cmd_Completer):
     def do_dump(self, args):
         "Print information about applications"
         opts = self.dump_options.parse_args(args.split())
+        # napplied can be used in -a
+        self._ensure_old_editions()
         persons = tuple(self.applications.filter(label=opts.label))
         if opts.highlanders:
             persons = (p for p in persons if p.highlander)
@@ -363,7 +462,9 @@ class Grader(cmd_completer.Cmd_Completer):
             #    print('Attribute', opts.attribute[0], 'not known!')
             #    persons = ()
             else:
-                persons = (p for p in persons if str(getattr(p, opts.attribute[0])) == opts.attribute[1])
+                found = self.applications.find_applicants_by_attribute(*opts.attribute)
+                found = set(map(id, found))
+                persons = (p for p in persons if id(p) in found)
 
         self._dump(persons, format=opts.format)
 
@@ -374,6 +475,8 @@ class Grader(cmd_completer.Cmd_Completer):
             self._dumpone(p, format=format)
 
     def _dumpone(self, p, format='short'):
+        # we show p.napplied
+        self._ensure_old_editions()
         position_other = \
             (' ({})'.format(p.position_other) if p.position=='Other' else '')
         if format == 'short':
@@ -452,11 +555,15 @@ class Grader(cmd_completer.Cmd_Completer):
 
 
     def print_grading_stats(self, what, applications):
-        if pandas is None:
+        # pandas takes a while to import, so only when needed
+        try:
+            import pandas
+        except ImportError:
             print('need pandas to show stats!')
             return
-        grades = pandas.DataFrame(list(self._gradings(p, what)) for p in applications)
-        stats = grades.apply(pandas.value_counts, dropna=False).fillna(0)
+        grades, graded = self._grading_rows(applications, what)
+        grades = pandas.DataFrame(grades)
+        stats = grades.apply(lambda column: column.value_counts(dropna=False)).fillna(0)
         stats.rename(index={'nan':'todo', 'NaN':'todo'}, inplace=True)
         print(stats)
 
@@ -556,16 +663,9 @@ class Grader(cmd_completer.Cmd_Completer):
             total = len(self.applications)
 
         if opts.disagreement is not None:
-            if opts.disagreement is all:
-                todo = [p for p in todo
-                        if (max(self._gradings(p, opts.what), default=0) -
-                            min(self._gradings(p, opts.what), default=0) > 1)]
-            else:
-                todo = [p for p in todo
-                        if (self._get_grading(p, opts.what) is not None and
-                            self._get_grading(p, opts.what, opts.disagreement) is not None and
-                            abs(self._get_grading(p, opts.what) -
-                                self._get_grading(p, opts.what, opts.disagreement)) > 1)]
+            identity = None if opts.disagreement is all else opts.disagreement
+            disagree = self._disagreement(todo, opts.what, identity)
+            todo = [p for p, flag in zip(todo, disagree) if flag]
             total = len(todo)
 
         done_already = total - len(todo)
@@ -639,16 +739,84 @@ class Grader(cmd_completer.Cmd_Completer):
         section = self.config[section_name(what, identity)]
         return section.get(person.fullname, None)
 
+    def _grading_matrix(self, what):
+        """Return the grades of all applicants by all identities
+
+        Returns two arrays of shape applicants × identities: the grades,
+        with nan where there is no grade or the grader abstained, and a
+        boolean mask which is true where there is a grade (also abstain).
+        The arrays are rebuilt when the config sections change behind our
+        back, _set_grading updates them in place.
+        """
+        sections = [self.config[section_name(what, identity)]
+                    for identity in IDENTITIES]
+        versions = len(self.applications), tuple(section.version for section in sections)
+        cached = self._grades.get(what)
+        if cached is None or cached[0] != versions:
+            rows = collections.defaultdict(list)
+            for row, person in enumerate(self.applications):
+                rows[person.fullname.lower()].append(row)
+            shape = len(self.applications), len(IDENTITIES)
+            grades = np.full(shape, np.nan)
+            graded = np.zeros(shape, dtype=bool)
+            for col, section in enumerate(sections):
+                for fullname, score in section.items():
+                    grades[rows.get(fullname, []), col] = score
+                    graded[rows.get(fullname, []), col] = True
+            cached = self._grades[what] = versions, grades, graded
+        return cached[1], cached[2]
+
+    def _grading_rows(self, persons, what):
+        "Return the rows of the grades and of the mask for persons"
+        grades, graded = self._grading_matrix(what)
+        rows = [self.applications.index(p) for p in persons]
+        return grades[rows], graded[rows]
+
     def _gradings(self, person, what):
-        gen = (
-            self.config[section_name(what, identity)].get(person.fullname, None)
-            for identity in IDENTITIES)
-        return list_of_float(gen)
+        try:
+            grades, graded = self._grading_rows([person], what)
+        except ValueError:
+            # not one of the current applicants
+            gen = (
+                self.config[section_name(what, identity)].get(person.fullname, None)
+                for identity in IDENTITIES)
+            return list_of_float(gen)
+        return list_of_float(score if valid else None
+                             for score, valid in zip(grades[0], graded[0]))
+
+    def _disagreement(self, persons, what, identity=None):
+        """Return a boolean array, true for persons whose grades differ by more than 1
+
+        If identity is given, compare the grades of identity and of the
+        current identity, otherwise the highest and the lowest grade.
+        """
+        grades, graded = self._grading_rows(persons, what)
+        with np.errstate(invalid='ignore'):
+            if identity is not None:
+                return np.abs(grades[:, self.identity] - grades[:, identity]) > 1
+            low = np.where(np.isnan(grades), np.inf, grades).min(axis=1)
+            high = np.where(np.isnan(grades), -np.inf, grades).max(axis=1)
+            return np.isfinite(low) & (high - low > 1)
 
     def _set_grading(self, person, what, score):
         assert isinstance(score, numbers.Number), score
-        section = self.config[section_name(what, self.identity)]
+        identity = self.identity
+        section = self.config[section_name(what, identity)]
+        col = IDENTITIES.index(identity)
+        cached = self._grades.get(what)
+        uptodate = (cached is not None and
+                    cached[0][1][col] == section.version)
         section[person.fullname] = score
+        if uptodate:
+            # update the matrix in place instead of rebuilding it
+            (count, versions), grades, graded = cached
+            rows = [row for row, p in enumerate(self.applications)
+                    if p.fullname.lower() == person.fullname.lower()]
+            grades[rows, col] = score
+            graded[rows, col] = True
+            versions = versions[:col] + (section.version,) + versions[col+1:]
+            self._grades[what] = (count, versions), grades, graded
+        self._mark_dirty(person)
         printff('{} score set to {}', what, score)
         self.modified = True
 
@@ -687,6 +855,7 @@ class Grader(cmd_completer.Cmd_Completer):
                 printff('labelling {} as {}',
                         person.fullname, ', '.join(labels))
                 self.applications.add_labels(person.fullname, labels)
+                self._mark_dirty(person)
                 continue
             elif choice == '':
                 choice = default
@@ -738,39 +907,57 @@ class Grader(cmd_completer.Cmd_Completer):
         institute = self._equiv_master(person.institute)
         return institute + ' | ' + group
 
+    # sections whose contents affect the scores or the order of everybody
+    RANKING_SECTIONS = ('programming_rating', 'open_source_rating',
+                        'python_rating', 'vcs_rating', 'underrep_rating',
+                        'equivs')
+
+    def _ranking_key(self, use_labels):
+        "Everything which requires all applicants to be rescored when changed"
+        return (self.formula, self.location, use_labels,
+                tuple(self.config[section].version
+                      for section in self.RANKING_SECTIONS),
+                tuple(self._applied_range()))
+
+    def _mark_dirty(self, *persons):
+        "Make the next ranking rescore those persons"
+        self._dirty.update(id(person) for person in persons)
+
+    def _order_key(self, person, index, use_labels):
+        score = self._score_with_labels(person, use_labels=use_labels)
+        # highest score first, nan last, ties in the order of applications
+        return (-score if not math.isnan(score) else math.inf), index
+
     def _assign_rankings(self, use_labels=False):
         "Order applications by rank"
         if self.formula is None:
             raise ValueError('formula not set yet')
 
-        #if self.ranking_done:
-        #    return
-        #else:
-        #    self.ranking_done = True
-        minsc, maxsc, contr = find_min_max(self.formula, self.location,
-                                           self.programming_rating,
-                                           self.open_source_rating,
-                                           self.python_rating,
-                                           self.vcs_rating,
-                                           self.underrep_rating,
-                                           self._applied_range())
+        applicants = self.applications.applicants
+        key = self._ranking_key(use_labels)
+        if self.ranking_done and key == self._ranking_state:
+            # only the applicants whose grades or labels changed
+            todo = [i for i, person in enumerate(applicants)
+                    if id(person) in self._dirty]
+            self._rescore([applicants[i] for i in todo])
+            for i in todo:
+                person = applicants[i]
+                old = self._ranking_keys[id(person)]
+                del self._ranking_order[bisect.bisect_left(self._ranking_order, old)]
+                new = self._ranking_keys[id(person)] = \
+                    self._order_key(person, i, use_labels)
+                bisect.insort(self._ranking_order, new)
+        else:
+            self._rescore(applicants)
+            self._ranking_keys = {id(person):self._order_key(person, i, use_labels)
+                                  for i, person in enumerate(applicants)}
+            self._ranking_order = sorted(self._ranking_keys.values())
+        self._dirty.clear()
+        self._ranking_state = key
+        self.ranking_done = True
 
-        for person in self.applications:
-            labels = self.applications.get_labels(person.fullname)
-            person.score = rank_person(person,
-                                       self.formula, self.location,
-                                       self.programming_rating,
-                                       self.open_source_rating,
-                                       self.python_rating,
-                                       self.vcs_rating,
-                                       self.underrep_rating,
-                                       self._gradings(person, 'motivation'),
-                                       minsc, maxsc,
-                                       labels,
-                                       person.napplied)
-        ordered = sorted(self.applications, key=lambda x: \
-                         self._score_with_labels(x, use_labels=use_labels),
-                         reverse=True)
+        ordered = [applicants[i] for _, i in self._ranking_order]
+        accept_count = self.accept_count
 
         rank, prevscore = 0, 10000
         highlander = True
@@ -796,13 +983,43 @@ class Grader(cmd_completer.Cmd_Completer):
                 finalrank = labs[lab] = rank
 
             count += 1
-            if highlander and person.score != prevscore and count > self.accept_count:
+            if highlander and person.score != prevscore and count > accept_count:
                 highlander = False
 
             person.rank = finalrank
             person.highlander = highlander
             prevscore = person.score
 
+    def _rescore(self, persons):
+        "Compute and set the score of persons"
+        if not persons:
+            return
+        minsc, maxsc, contr = find_min_max(self.formula, self.location,
+                                           self.programming_rating,
+                                           self.open_source_rating,
+                                           self.python_rating,
+                                           self.vcs_rating,
+                                           self.underrep_rating,
+                                           self._applied_range())
+
+        # look everything up once, and not once per applicant
+        formula, code, location = self.formula, self.formula_code, self.location
+        ratings = (self.programming_rating,
+                   self.open_source_rating,
+                   self.python_rating,
+                   self.vcs_rating,
+                   self.underrep_rating)
+        scores = rank_applicants(persons,
+                                 formula, location,
+                                 *ratings,
+                                 self._grading_rows(persons, 'motivation')[0],
+                                 minsc, maxsc,
+                                 [self.applications.get_labels(p.fullname) for p in persons],
+                                 [p.napplied for p in persons],
+                                 code=code)
+        for person, score in zip(persons, scores):
+            person.score = score
+
     def _ranked(self, applicants=None, use_labels=False):
         self._assign_rankings(use_labels=use_labels)
 
@@ -814,11 +1031,21 @@ class Grader(cmd_completer.Cmd_Completer):
 
     def _equiv_master(self, variant):
         "Return the key for equiv canocalization"
-        for key, values in self.config['equivs'].items():
-            if (variant.lower() == key.lower() or
-                variant.lower() in (spelling.lower() for spelling in values)):
-                return key
-        return variant.strip()
+        section = self.config['equivs']
+        if self._equivs is None or self._equivs[0] != section.version:
+            # lowercased key or spelling -> key, the first key wins
+            table = {}
+            for key, values in section.items():
+                table.setdefault(key.lower(), key)
+                for spelling in values:
+                    table.setdefault(spelling.lower(), key)
+            self._equivs = section.version, table, {}
+        _, table, memo = self._equivs
+        try:
+            return memo[variant]
+        except KeyError:
+            master = memo[variant] = table.get(variant.lower(), variant.strip())
+            return master
 
     rank_options = cmd_completer.PagedArgumentParser('rank')\
         .add_argument('-s', '--short', action='store_const',
@@ -926,9 +1153,32 @@ class Grader(cmd_completer.Cmd_Completer):
         "Display statistics"
         opts = self.stat_options.parse_args(args.split())
         edition = opts.edition
+        filenames = [filename for filename in self._old_filenames
+                     if filename.split('/')[0] == edition]
+        if (filenames and self._applications_old is None
+                and not opts.highlanders and not opts.label):
+            # count while reading the file, the other editions are not needed
+            pool = stream_applications_csv_file(
+                filenames[-1], self.config['fields'],
+                dialects=self.config['csv_dialects'])
+            self._compute_and_print_stats(pool, opts.detailed)
+            return
+        # needed for napplied and for the other editions
+        self._ensure_old_editions()
 
         if edition == 'current':
-            applicants = list(self.applications)
+            # count on the columns of the applicant table
+            table = self.applications.table
+            rows = np.arange(len(table))
+            if opts.highlanders:
+                self._assign_rankings(use_labels=opts.use_labels)
+                rows = np.flatnonzero(table['highlander'])
+            if opts.label:
+                labelled = [self.applications.index(p)
+                            for p in self.applications.filter(label=opts.label)]
+                rows = np.intersect1d(rows, np.array(labelled, dtype=int))
+            self._compute_and_print_stats(rows, opts.detailed, table=table)
+            return
         elif edition == 'all':
             applicants = list(self.applications)
             for school, app_old in self.applications_old.items():
@@ -947,18 +1197,28 @@ class Grader(cmd_completer.Cmd_Completer):
 
         self._compute_and_print_stats(pool, opts.detailed)
 
-    def _compute_and_print_stats(self, pool, detailed):
-        """ Given a pool of applicants, compute and display some statistics.
+    def _compute_and_print_stats(self, pool, detailed, table=None):
+        """ Given a pool (any iterable) of applicants, compute and display some statistics.
+
+        If table is given, pool holds rows of this ApplicantTable.
         """
-        observables = ['born', 'gender', 'nationality', 'affiliation',
-                       'position', 'applied', 'napplied', 'open_source',
-                       'programming', 'python', 'vcs', 'underrep']
-        counters = {var: collections.Counter(getattr(p, var, NOT_AVAILABLE_LABEL)
-                                             for p in pool)
-                    for var in observables}
+        observables = STAT_OBSERVABLES
+        if table is not None:
+            applicants = len(pool)
+            missing = collections.Counter({NOT_AVAILABLE_LABEL: applicants}
+                                          if applicants else {})
+            counters = {var: table.counts(var, pool) if var in table else missing.copy()
+                        for var in observables}
+        else:
+            # go through the pool only once, it can be a generator
+            counters = {var: collections.Counter() for var in observables}
+            applicants = 0
+            for p in pool:
+                applicants += 1
+                for var in observables:
+                    counters[var][getattr(p, var, NOT_AVAILABLE_LABEL)] += 1
 
         length = {var: len(counters[var]) for var in observables}
-        applicants = len(pool)
         FMT_STAT = '{:<26.26} = {:>5d}'
         FMT_STAP = FMT_STAT + ' ({:4.1f}%)'
         printf(FMT_STAT, 'Pool', applicants)
@@ -1000,8 +1260,10 @@ class Grader(cmd_completer.Cmd_Completer):
 
     def do_wiki(self, args):
         "Dump statistics of CONFIRMED people for the Wiki."
+        # needed for napplied
+        self._ensure_old_editions()
         confirmed = tuple(self.applications.filter(label=('CONFIRMED')))
-        applicants = list(self.applications)
+        table = self.applications.table
         print('====== Students ======')
         # we want first a list of confirmed with names/nationality/affiliations
         self._wiki_tb_head(('Firstname', 'Lastname', 'Nationality', 'Affiliation'))
@@ -1016,16 +1278,15 @@ class Grader(cmd_completer.Cmd_Completer):
         self._wiki_tb_head(('','Applicants', 'Participants'))
 
         # first collect statistics like we do in the do_stat method (DRY ;))))
-        observables = ['born', 'gender', 'nationality', 'affiliation',
-                       'position', 'applied', 'napplied', 'open_source',
-                       'programming', 'python', 'vcs', 'underrep']
+        observables = STAT_OBSERVABLES
+        rows = [self.applications.index(p) for p in confirmed]
         c_confirmed = {}
         c_applicants = {}
         for var in observables:
-            c_confirmed[var] = collections.Counter(getattr(p, var) for p in confirmed)
-            c_applicants[var] = collections.Counter(getattr(p, var) for p in applicants)
+            c_confirmed[var] = table.counts(var, rows)
+            c_applicants[var] = table.counts(var)
 
-        Na = len(applicants)
+        Na = len(table)
         Nc = len(confirmed)
 
 
@@ -1099,6 +1360,7 @@ class Grader(cmd_completer.Cmd_Completer):
                 applications.add_labels(fullname, labels)
             else:
                 applications.clear_labels(fullname)
+            self._mark_dirty(applications.find_applicant_by_fullname(fullname))
             self.modified = True
         else:
             display_by_label = any(label in set(args.split())
@@ -1107,10 +1369,9 @@ class Grader(cmd_completer.Cmd_Completer):
                 for label in args.split():
                     count = 0
                     printf('== {} ==', label)
-                    for applicant in applications:
-                        if label in applicant.labels:
-                            printf('{}. {}', count, applicant.fullname.lower())
-                            count += 1
+                    for applicant in applications.filter(label=label):
+                        printf('{}. {}', count, applicant.fullname.lower())
+                        count += 1
                     printf('== {} labelled ==', count)
             else:
                 applicant = applications.find_applicant_by_fullname(args)
@@ -1209,9 +1470,22 @@ def _write_file_samelab(filename, persons):
         f.write(names+';'+emails+'\n')
     printf("'{}' written with header + {} entries", filename, i + 1)
 
-def eval_formula(formula, vars):
+@functools.lru_cache(maxsize=128)
+def compile_formula(formula):
+    "Compile formula to a code object (cached on the formula text)"
+    # eval() ignores leading whitespace in strings, compile() does not
+    return compile(formula.strip(), '--formula--', 'eval')
+
+def eval_formula(formula, vars, code=None):
+    """Evaluate formula with vars as the namespace
+
+    Pass the precompiled code if available, otherwise the formula text
+    is compiled (and cached) here.
+    """
+    if code is None:
+        code = compile_formula(formula)
     try:
-        return eval(formula, vars, {})
+        return eval(code, vars, {})
     except (NameError, TypeError) as e:
         vars.pop('__builtins__', None)
         msg = 'formula failed: {}\n[{}]\n[{}]'.format(e, formula,
@@ -1260,7 +1534,7 @@ def gender_to_formula_label(label):
 def rank_person(person, formula, location,
                 programming_rating, open_source_rating, python_rating, vcs_rating, underrep_rating,
                 motivation_scores, minsc, maxsc, labels,
-                applied):
+                applied, code=None):
     "Apply formula to person and return score"
     vars = {}
     for attr, dict in zip(('programming', 'open_source', 'python', 'vcs', 'underrep'),
@@ -1281,7 +1555,7 @@ def rank_person(person, formula, location,
                 email=person.email, # should we discriminate against gmail?
                 labels=labels,
                 )
-    score = eval_formula(formula, vars)
+    score = eval_formula(formula, vars, code=code)
     # we want to round the score, to avoid wrong rankings due to numerical
     # noise. Example: 1.26 and 1.2600000000002 are the same score.
     # Round to 5 digits. That should be above any numerical noise but still
@@ -1299,18 +1573,190 @@ def rank_person(person, formula, location,
     #score = (score - minsc) / (maxsc - minsc) * range + offset
     return score
 
-def _yield_values(var, *values):
-    for value in values:
-        yield var, value
+# Formula variables which have one value per person and cannot be
+# represented as a flat array (labels is a list for each person).
+NON_VECTOR_VARS = {'labels'}
+
+# AST nodes which work elementwise on numpy arrays just like on scalars.
+_VECTOR_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Compare,
+                 ast.Name, ast.Load, ast.operator, ast.cmpop)
+_VECTOR_CONSTANTS = tuple(getattr(ast, name) for name in
+                          ('Constant', 'Num', 'Str', 'NameConstant')
+                          if hasattr(ast, name))
+
+@functools.lru_cache(maxsize=128)
+def is_vectorizable(formula):
+    """Return true if formula can be evaluated over arrays of all applicants
+
+    Only arithmetic and single comparisons are allowed. 'and', 'or', 'not',
+    '~' (logical on bool arrays, bitwise on Python bools), 'in',
+    conditional expressions, function calls, subscripts and the labels
+    variable need the scalar path.
+    """
+    tree = ast.parse(formula, mode='eval')
+    for node in ast.walk(tree):
+        if isinstance(node, _VECTOR_CONSTANTS + (ast.unaryop,)):
+            if isinstance(node, (ast.Not, ast.Invert)):
+                return False
+            continue
+        if not isinstance(node, _VECTOR_NODES):
+            return False
+        if isinstance(node, (ast.In, ast.NotIn, ast.Is, ast.IsNot)):
+            return False
+        if isinstance(node, ast.Compare) and len(node.ops) > 1:
+            # chained comparisons are evaluated with an implicit 'and'
+            return False
+        if isinstance(node, ast.Name) and node.id in NON_VECTOR_VARS:
+            return False
+    return True
+
+def _rating_column(name, rating, applicants):
+    "Look up the rating for each applicant, once per distinct answer"
+    cache = {}
+    column = np.empty(len(applicants))
+    for i, person in enumerate(applicants):
+        key = getattr(person, name)
+        try:
+            column[i] = cache[key]
+        except KeyError:
+            column[i] = cache[key] = get_rating(name, rating, key)
+    return column
+
+def _mean_scores(scores):
+    "Return the mean of each row ignoring missing values, nan if none are left"
+    scores = np.asarray(scores, dtype=float)
+    valid = ~np.isnan(scores)
+    with np.errstate(invalid='ignore'):
+        return np.where(valid, scores, 0).sum(axis=1) / valid.sum(axis=1)
+
+def rank_applicants(applicants, formula, location,
+                    programming_rating, open_source_rating, python_rating, vcs_rating, underrep_rating,
+                    motivation_scores, minsc, maxsc, labels,
+                    applied, code=None):
+    """Apply formula to all applicants at once and return a list of scores
+
+    motivation_scores, labels and applied hold one entry per applicant;
+    motivation_scores is a list of lists of scores or a 2-d array, with
+    None or nan for missing grades.
+    The formula variables are materialized as numpy arrays and the formula
+    is evaluated once. Formulas which cannot be evaluated elementwise
+    (see is_vectorizable) go through rank_person one applicant at a time.
+    """
+    def scalar():
+        return [rank_person(person, formula, location,
+                            programming_rating, open_source_rating,
+                            python_rating, vcs_rating, underrep_rating,
+                            list_of_float(scores), minsc, maxsc, labels_, napplied,
+                            code=code)
+                for person, scores, labels_, napplied
+                in zip(applicants, motivation_scores, labels, applied)]
+
+    if len(applicants) == 0:
+        return []
+    if not is_vectorizable(formula):
+        return scalar()
+
+    # Coordinate with rank_person!
+    # Only the variables used in the formula are materialized.
+    columns = dict(
+        programming=lambda: _rating_column('programming', programming_rating, applicants),
+        open_source=lambda: _rating_column('open_source', open_source_rating, applicants),
+        python=lambda: _rating_column('python', python_rating, applicants),
+        vcs=lambda: _rating_column('vcs', vcs_rating, applicants),
+        underrep=lambda: _rating_column('underrep', underrep_rating, applicants),
+        born=lambda: np.array([int(p.born) if p.born else 0 for p in applicants]),
+        gender=lambda: np.array([gender_to_formula_label(p.gender) for p in applicants]),
+        nonmale=lambda: np.array([p.nonmale for p in applicants]),
+        female=lambda: np.array([p.nonmale for p in applicants]),
+        applied=lambda: np.array(applied),
+        nationality=lambda: np.array([p.nationality for p in applicants]),
+        affiliation=lambda: np.array([p.affiliation for p in applicants]),
+        location=lambda: location,
+        motivation=lambda: _mean_scores(motivation_scores),
+        email=lambda: np.array([p.email for p in applicants]),
+    )
+    vars = {name:columns[name]() for name in find_names(formula) if name in columns}
+    try:
+        with np.errstate(all='ignore'):
+            score = eval_formula(formula, vars, code=code)
+        score = np.broadcast_to(np.asarray(score, dtype=float), (len(applicants),))
+    except (ValueError, TypeError):
+        # numpy does not like this formula after all, e.g. adding strings
+        return scalar()
+    # same rounding as in rank_person
+    score = np.round(score, 5)
+    labelled = np.array([bool(labels_) for labels_ in labels])
+    ok = np.isnan(score) | ((minsc <= score) & (score <= maxsc)) | labelled
+    assert ok.all(), (minsc, score[~ok], maxsc)
+    return score.tolist()
 
 def find_names(formula):
     g = tokenize.tokenize(io.BytesIO(formula.encode('utf-8')).readline)
     return set(tokval for toknum, tokval, _, _, _  in g
                       if toknum == token.NAME and not keyword.iskeyword(tokval))
 
+def _signed_terms(node, sign=1):
+    "Split the top-level sum in an AST into (sign, term) pairs"
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Sub)):
+        yield from _signed_terms(node.left, sign)
+        yield from _signed_terms(node.right,
+                                 sign if isinstance(node.op, ast.Add) else -sign)
+    else:
+        yield sign, node
+
+def _separable_parts(formula):
+    """Split formula into parts which do not share any variables
+
+    Returns a list of (names, [(sign, code), ...]) pairs. The value of
+    the formula is the sum of the values of the parts, and since the parts
+    are independent, so are its minimum and maximum.
+    """
+    parts = []
+    for sign, node in _signed_terms(ast.parse(formula.strip(), mode='eval').body):
+        names = {n.id for n in ast.walk(node) if isinstance(n, ast.Name)}
+        code = compile(ast.Expression(body=node), '--formula--', 'eval')
+        terms = [(sign, code)]
+        # merge with all parts which share some names with this term
+        for part in [part for part in parts if part[0] & names]:
+            parts.remove(part)
+            names |= part[0]
+            terms = part[1] + terms
+        parts.append((names, terms))
+    return parts
+
+def _part_min_max(formula, names, terms, choices):
+    "Enumerate all values of the variables used in one separable part"
+    names = sorted(names)
+    values = [sum(sign * eval_formula(formula, dict(zip(names, vars)), code=code)
+                  for sign, code in terms)
+              for vars in itertools.product(*(choices[n] for n in names))]
+    if not values:
+        return None
+    return min(values), max(values)
+
 def find_min_max(formula, location,
                  programming_rating, open_source_rating, python_rating, vcs_rating, underrep_rating,
                  applied):
+    """Return the minimum and maximum score, and the contributions of terms
+
+    The formula is split into parts which can be bounded independently and
+    only the combinations of values of variables within each part are
+    tried. Results are cached on the formula and the contents of the
+    rating sections.
+    """
+    minsc, maxsc, items = _find_min_max(formula, location,
+                                        tuple(programming_rating.values()),
+                                        tuple(open_source_rating.values()),
+                                        tuple(python_rating.values()),
+                                        tuple(vcs_rating.values()),
+                                        tuple(underrep_rating.values()),
+                                        max(applied))
+    return minsc, maxsc, collections.OrderedDict(items)
+
+@functools.lru_cache(maxsize=32)
+def _find_min_max(formula, location,
+                  programming_rating, open_source_rating, python_rating, vcs_rating, underrep_rating,
+                  max_applied):
     # Coordinate with rank_person!
     # Labels are excluded from this list, they add "extra" points.
     # And we would have to test all combinations of labels, which can be slow.
@@ -1318,33 +1764,36 @@ def find_min_max(formula, location,
         born=(1900, 2012),
         gender=tuple(set(KNOWN_GENDER_LABELS.values())),
         nonmale=(0, 1),
-        applied=(0, max(applied)),
+        female=(0, 1),
+        applied=(0, max_applied),
         nationality=('Nicaragua', 'Československo', location),
         affiliation=('Československo', 'Nicaragua', location),
         location=(location,),
         motivation=SCORE_RANGE,
-        programming=programming_rating.values(),
-        open_source=open_source_rating.values(),
-        python=python_rating.values(),
-        vcs=vcs_rating.values(),
-        underrep=underrep_rating.values(),
+        programming=programming_rating,
+        open_source=open_source_rating,
+        python=python_rating,
+        vcs=vcs_rating,
+        underrep=underrep_rating,
         labels=())
-    needed = list(_yield_values(n, *choices[n]) for n in find_names(formula))
-    options = tuple(itertools.product(*needed))
-    values = [eval_formula(formula, dict(vars)) for vars in options]
-    if not values:
-        return float('nan'), float('nan'), {}
+    # repeated values cannot change the result
+    choices = {name:tuple(dict.fromkeys(values)) for name, values in choices.items()}
+
+    bounds = [_part_min_max(formula, names, terms, choices)
+              for names, terms in _separable_parts(formula)]
+    if None in bounds:
+        return float('nan'), float('nan'), ()
 
-    minsc = min(values)
-    maxsc = max(values)
+    # same rounding as the scores in rank_person
+    minsc = round(sum(min_ for min_, max_ in bounds), 5)
+    maxsc = round(sum(max_ for min_, max_ in bounds), 5)
     # scorporate in single contributions
-    items = collections.OrderedDict()
+    items = []
     for item in formula.split('+'):
-        values = [eval_formula(item, dict(vars)) for vars in options]
-        max_ = max(values)
-        min_ = min(values)
-        items[item] = (max_-min_)/(maxsc-minsc)*100
-    return minsc, maxsc, items
+        min_, max_ = _part_min_max(item, find_names(item),
+                                   [(1, compile_formula(item))], choices)
+        items.append((item, (max_-min_)/(maxsc-minsc)*100))
+    return minsc, maxsc, tuple(items)
 
 def wrap_paragraphs(text, prefix=''):
     prefix = '\n' + ' ' * len(prefix)
@@ -1355,10 +1804,31 @@ def wrap_paragraphs(text, prefix=''):
     return ('\n'+prefix).join(wrapped)
 
 
+class VersionAction(argparse.Action):
+    "Print the version and the git revision, which is only looked up here"
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, **kwargs):
+        super().__init__(option_strings, dest, nargs=0, **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        print('grader {} ({})'.format(__version__, revision()))
+        parser.exit()
+
 grader_options = cmd_completer.ModArgumentParser('grader')\
+    .add_argument('--version', action=VersionAction,
+                  help='show the version and git revision and exit')\
     .add_argument('-i', '--identity', type=int,
                   choices=IDENTITIES,
                   help='Index of person grading applications')\
+    .add_argument('--defer-old', action='store_true',
+                  help='load applications for previous editions only when needed')\
+    .add_argument('--cache-dir', default=CACHE_DIR,
+                  help='keep snapshots of parsed applications for previous'
+                       ' editions here (default: %(default)s)')\
+    .add_argument('--no-cache', action='store_const', dest='cache_dir', const=None,
+                  help='always parse the applications for previous editions')\
+    .add_argument('--lazy-text', action='store_true',
+                  help='keep long free-text fields (cv, motivation, ...) on disk'
+                       ' until they are shown')\
     .add_argument('config', type=our_configfile, nargs='?',
                   default=os.path.join(os.getcwd(), 'grader.conf'))\
     .add_argument('applications', type=str, nargs='*',
@@ -1370,7 +1840,9 @@ def main():
     logging.basicConfig(level=logging.INFO)
 
     opts = grader_options.parse_args()
-    cmd = Grader(opts.identity, opts.config, opts.applications)
+    cmd = Grader(opts.identity, opts.config, opts.applications,
+                 defer_old=opts.defer_old, cache_dir=opts.cache_dir,
+                 lazy_text=opts.lazy_text)
 
     if sys.stdin.isatty():
         while True:
@@ -1,10 +1,24 @@
+import pickle
 from io import StringIO
 from textwrap import dedent
 
+import numpy as np
 from pytest import raises
 
 from .configfile import ConfigFile
-from .applications import Applications, build_person_factory
+from .applications import (
+    Applications,
+    LazyRecord,
+    LimeSurveyDialect,
+    build_person_factory,
+    col_name_to_field,
+    csv_header_to_fields,
+    detect_csv_dialect,
+    dialect_from_str,
+    dialect_to_str,
+    iter_applications_csv_file,
+    load_applications_csv_file,
+)
 from .util import list_of_str
 
 
@@ -47,6 +61,56 @@ def test_applications_from_paths(tmpdir):
     assert applications.applicants[0].labels == ['VEGAN']
 
 
+def test_applications_from_paths_snapshot(tmpdir, capsys):
+    csv_string = dedent("""
+        "First name","Last name","Email address","cv"
+        "John","Doe","john.dow@nowhere.com","Born, lived"
+        "Mary Jane","Smith","mary82@something.org",""
+        """).strip()
+    config_tmpfile, csv_tmpfile = _tmp_application_files(
+        tmpdir, '[labels]\nmary jane smith = VIP\n', csv_string)
+    cache_dir = tmpdir.join('cache').strpath
+    fields_to_col_names_section = {
+        'name': ['First name'],
+        'lastname': ['Last name'],
+        'email': ['Email address'],
+        'cv': ['cv'],
+    }
+
+    def load(fields=fields_to_col_names_section):
+        applications = Applications.from_paths(
+            config_tmpfile.strpath, csv_tmpfile.strpath, fields,
+            cache_dir=cache_dir, lazy_fields=('cv',))
+        out, err = capsys.readouterr()
+        return applications, '(snapshot)' in out
+
+    applications, from_snapshot = load()
+    assert not from_snapshot
+    applications, from_snapshot = load()
+    assert from_snapshot
+    assert applications.applicants[1].fullname == 'Mary Jane Smith'
+    assert applications.applicants[1].labels == ['VIP']
+    assert applications.applicants[0].cv == 'Born, lived'
+
+    # a different mapping of the fields invalidates the snapshot
+    fields = dict(fields_to_col_names_section, email=['Email'])
+    applications, from_snapshot = load(fields)
+    assert not from_snapshot
+
+    # and so does a modified file
+    csv_tmpfile.write(csv_string + '\n"Ben","Johnson","ben@ben.org",""')
+    applications, from_snapshot = load()
+    assert not from_snapshot
+    assert len(applications) == 3
+
+    # a snapshot with unexpected contents is ignored
+    snapshot, = tmpdir.join('cache').listdir()
+    snapshot.write_binary(pickle.dumps(42))
+    applications, from_snapshot = load()
+    assert not from_snapshot
+    assert len(applications) == 3
+
+
 def test_applications_init():
     config_string = dedent("""
     [labels]
@@ -81,6 +145,35 @@ def test_applications_find_applicant_by_fullname():
         applications.find_applicant_by_fullname('johnny mnemonic')
 
 
+def test_applications_find_applicant_by_email():
+    config = ConfigFile(StringIO(''), labels=list_of_str)
+
+    person_factory = build_person_factory(['name', 'lastname', 'email'])
+    john_doe = person_factory('John', 'Doe', 'John.Doe@nowhere.com')
+    applications = Applications([john_doe], config)
+
+    assert applications.find_applicant_by_email('john.doe@nowhere.com') is john_doe
+    with raises(ValueError):
+        applications.find_applicant_by_email('jd@nowhere.com')
+
+
+def test_applications_append():
+    config_string = dedent("""
+    [labels]
+    ben johnson = VIPER
+    """)
+    config = ConfigFile(StringIO(config_string), labels=list_of_str)
+
+    person_factory = build_person_factory(['name', 'lastname'])
+    applications = Applications([person_factory('John', 'Doe')], config)
+    ben_johnson = person_factory('Ben', 'Johnson')
+    applications.append(ben_johnson)
+
+    assert len(applications) == 2
+    assert applications.find_applicant_by_fullname('Ben Johnson') is ben_johnson
+    assert ben_johnson.labels == ['VIPER']
+
+
 def test_applications_add_labels():
     config_string = dedent("""
     [labels]
@@ -179,6 +272,27 @@ def test_applications_filter_attributes():
     with raises(AttributeError):
         applications.filter(dummy='Error')
 
+    # the index is kept up to date
+    carla_verdi = person_factory('Carla', 'Verdi', 'Italy', 'Female')
+    applications.append(carla_verdi)
+    assert applications.filter(nationality='Italy', nonmale=True) == [lucia_bianchi, carla_verdi]
+
+
+def test_applications_find_applicants_by_attribute():
+    config = ConfigFile(StringIO(''), labels=list_of_str)
+
+    person_factory = build_person_factory(['name', 'lastname', 'born'])
+    mario_rossi = person_factory('Mario', 'Rossi', '1980')
+    fritz_lang = person_factory('Fritz', 'Lang', '1890')
+    applications = Applications([mario_rossi, fritz_lang], config)
+
+    assert applications.find_applicants_by_attribute('born', '1890') == [fritz_lang]
+    assert applications.find_applicants_by_attribute('fullname', 'Mario Rossi') == [mario_rossi]
+    assert applications.find_applicants_by_attribute('born', '2000') == []
+    # not indexed, because it can change
+    mario_rossi.napplied = 2
+    assert applications.find_applicants_by_attribute('napplied', '2') == [mario_rossi]
+
 
 def test_applications_filter_labels():
     config_string = dedent("""
@@ -201,6 +315,15 @@ def test_applications_filter_labels():
     assert applications.filter(label=('DELTA', 'MIKE', '-', 'ECHO')) == [mario_rossi]
     assert applications.filter(label=('DELTA', 'MIKE', '-', 'ECHO', 'ALFA')) == []
     assert applications.filter(label='NOLABEL') == []
+    assert applications.filter(label=('-', 'ECHO')) == [mario_rossi]
+
+    # the label index follows changes
+    applications.add_labels('fritz lang', ['ALFA'])
+    assert applications.filter(label='ALFA') == [mario_rossi, fritz_lang]
+    applications.clear_labels('mario rossi')
+    assert applications.filter(label='ALFA') == [fritz_lang]
+    assert applications.filter(label=('-', 'ECHO')) == [mario_rossi]
+    assert applications.get_all_labels() == {'ALFA', 'DELTA', 'ECHO', 'MIKE', 'ZULU'}
 
 
 def test_applications_iteration():
@@ -220,3 +343,175 @@ def test_applications_iteration():
     # test that we can call len
     assert len(applications) == len(applications.applicants)
     assert result == list(applications)
+
+
+def test_person_factory():
+    person_factory = build_person_factory(['name', 'lastname', 'nationality', 'applied'])
+    mario = person_factory('Mario', 'Rossi', ''.join(['Ita', 'ly']), 'Y')
+    luigi = person_factory(name='Luigi', lastname='Rossi',
+                           nationality=''.join(['It', 'aly']), applied='N')
+
+    assert not hasattr(mario, '__dict__')
+    with raises(AttributeError):
+        mario.nickname = 'Super'
+    # categorical values share one string
+    assert mario.nationality is luigi.nationality
+    assert mario.applied == 'Y'
+    assert mario.napplied == 0
+    assert mario.labels == []
+    assert mario.fullname == 'Mario Rossi'
+
+    assert tuple(mario) == ('Mario', 'Rossi', 'Italy', 'Y')
+    assert mario[1] == 'Rossi'
+    assert mario == person_factory('Mario', 'Rossi', 'Italy', 'Y')
+    assert mario != luigi
+    assert repr(luigi) == ("Person(name='Luigi', lastname='Rossi', "
+                           "nationality='Italy', applied='N')")
+    with raises(TypeError):
+        person_factory('Mario', 'Rossi')
+
+
+def test_iter_applications_csv_file_lazy(tmpdir):
+    csv_string = dedent("""
+        "First name","Last name","Motivation"
+        "John","Doe","I want to learn
+        about ""numpy"", and Grüße"
+        "Mary Jane","Smith",""
+        "Ben","Johnson","Because"
+        """).strip()
+    csv_tmpfile = tmpdir.join('test_applications.csv')
+    csv_tmpfile.write_binary(b'\xef\xbb\xbf' + csv_string.encode('utf-8'))
+    fields_to_col_names_section = {
+        'name': ['First name'],
+        'lastname': ['Last name'],
+        'motivation': ['Motivation'],
+    }
+
+    with open(csv_tmpfile.strpath, 'rb') as f:
+        applicants = iter_applications_csv_file(
+            f, fields_to_col_names_section, lazy_fields=('motivation', 'cv'))
+        john = next(applicants)
+        mary, ben = applicants
+
+    assert john.name == 'John'
+    assert isinstance(john._raw()[2], LazyRecord)
+    assert john.motivation == 'I want to learn\nabout "numpy", and Grüße'
+    assert 'Grüße' in str(john)
+    assert mary.motivation == ''
+    assert ben.motivation == 'Because'
+    assert repr(ben) == "Person(name='Ben', lastname='Johnson', motivation='Because')"
+
+    # the file is not read again after it changed
+    csv_tmpfile.write('"First name","Last name","Motivation"')
+    with raises(ValueError):
+        ben.motivation
+
+    with raises(ValueError):
+        with open(csv_tmpfile.strpath, newline='', encoding='utf-8-sig') as f:
+            next(iter_applications_csv_file(
+                f, fields_to_col_names_section, lazy_fields=('motivation',)))
+
+
+def test_applications_table():
+    person_factory = build_person_factory(['name', 'lastname', 'nationality'])
+    applications = Applications([person_factory('Mario', 'Rossi', 'Italy'),
+                                 person_factory('Fritz', 'Lang', 'Germany'),
+                                 person_factory('Luigi', 'Rossi', 'Italy')],
+                                None)
+    applications.derive('italian', lambda table: table['nationality'] == 'Italy')
+    table = applications.table
+
+    assert table['lastname'].tolist() == ['Rossi', 'Lang', 'Rossi']
+    assert table['italian'].tolist() == [True, False, True]
+    assert table.counts('nationality') == {'Italy': 2, 'Germany': 1}
+    assert list(table.counts('nationality')) == ['Italy', 'Germany']
+    assert table.counts('lastname', rows=[0, 1]) == {'Rossi': 1, 'Lang': 1}
+    assert table.map('nationality', len).tolist() == [5, 7, 5]
+
+    # the grader state is read again at every access
+    applications[1].score = 2.5
+    applications[2].napplied = 3
+    assert table['score'][1] == 2.5
+    assert np.isnan(table['score'][0])
+    assert table['napplied'].tolist() == [0, 0, 3]
+
+    frame = table.to_pandas(['name', 'score'])
+    assert list(frame.columns) == ['name', 'score']
+    assert frame['score'][1] == 2.5
+
+    applications.append(person_factory('Anna', 'Bianchi', 'Italy'))
+    assert applications.table['name'].tolist() == ['Mario', 'Fritz', 'Luigi', 'Anna']
+    with raises(KeyError):
+        table['email']
+
+
+def test_col_name_to_field():
+    fields_to_col_names = {
+        'name': ['First name'],
+        'position': ['position'],
+        'position_other': ['[other] position'],
+        'cv': ['curriculum vitae'],
+        'python': ['Python', 'python'],
+        'programming': ['programming', 'Python'],
+    }
+    assert col_name_to_field('position', fields_to_col_names) == 'position'
+    assert col_name_to_field('[other] position', fields_to_col_names) == 'position_other'
+    assert col_name_to_field('POSITION. What is it?', fields_to_col_names) == 'position'
+    assert col_name_to_field('"First name"', fields_to_col_names) == 'name'
+    assert col_name_to_field('Please type in a short curriculum vitae',
+                             fields_to_col_names) == 'cv'
+    # the first key with an exact match wins
+    assert col_name_to_field('Python', fields_to_col_names) == 'python'
+    with raises(KeyError):
+        col_name_to_field('Your Python programming', fields_to_col_names)
+    with raises(KeyError):
+        col_name_to_field('Email', fields_to_col_names)
+
+    header = ['First name', 'curriculum vitae', 'Email']
+    with raises(KeyError):
+        list(csv_header_to_fields(header, fields_to_col_names))
+
+
+def test_csv_dialects(tmpdir, monkeypatch):
+    assert detect_csv_dialect('"First name","Last name"\r\n"John","Doe"\r\n') \
+        is LimeSurveyDialect
+    semicolon = detect_csv_dialect('name;lastname\nJohn;Doe\nMary;Smith\n')
+    assert semicolon.delimiter == ';'
+
+    assert dialect_from_str(dialect_to_str(LimeSurveyDialect)) is LimeSurveyDialect
+    saved = dialect_to_str(semicolon)
+    assert dialect_from_str(saved).delimiter == ';'
+    with raises(ValueError):
+        dialect_from_str('semicolons please')
+
+    csv_tmpfile = tmpdir.join('applications.csv')
+    csv_tmpfile.write('name;lastname\nJohn;Doe\nMary;Smith\n')
+    fields_to_col_names_section = {'name': ['name'], 'lastname': ['lastname']}
+    dialects = {}
+    applicants = load_applications_csv_file(
+        csv_tmpfile.strpath, fields_to_col_names_section, dialects=dialects)
+    assert dialects == {csv_tmpfile.strpath: saved}
+    assert applicants[1].lastname == 'Smith'
+
+    # the next time the saved dialect is used, and the file is not sniffed
+    def sniff(*args):
+        raise AssertionError('sniffed')
+    monkeypatch.setattr('csv.Sniffer.sniff', sniff)
+    applicants = load_applications_csv_file(
+        csv_tmpfile.strpath, fields_to_col_names_section, dialects=dialects)
+    assert applicants[1].lastname == 'Smith'
+
+    # a corrected dialect is used even if there is a snapshot
+    csv_tmpfile.write('name,lastname\n"John",Doe\n"Mary",Smith\n')
+    cache_dir = tmpdir.join('cache').strpath
+    dialects = {csv_tmpfile.strpath: repr((',', "'", False))}
+    monkeypatch.undo()
+
+    def names():
+        applicants = load_applications_csv_file(
+            csv_tmpfile.strpath, fields_to_col_names_section,
+            cache_dir=cache_dir, dialects=dialects)
+        return [p.name for p in applicants]
+    assert names() == ['"John"', '"Mary"']
+    dialects[csv_tmpfile.strpath] = repr((',', '"', False))
+    assert names() == ['John', 'Mary']
@@ -1,6 +1,7 @@
 from io import StringIO
 
 from .configfile import ConfigFile
+from .util import list_of_str
 
 
 CONFIG_STRING_MINIMAL = """
@@ -72,3 +73,39 @@ def test_configfile_save(tmpdir):
 
         assert config_reread.sections['programming_rating']['novice'] == -1.0
         assert config_reread.sections['python_rating']['competent'] == 100.0
+
+
+def test_section_version():
+    config = ConfigFile(StringIO(CONFIG_STRING_MINIMAL), programming_rating=float)
+    section = config.sections['programming_rating']
+
+    version = section.version
+    section['novice'] = -1.0
+    assert section.version > version
+
+    version = section.version
+    section.clear('novice')
+    assert section.version > version
+
+
+def test_section_cache():
+    config = ConfigFile(StringIO(CONFIG_STRING_MINIMAL), programming_rating=float,
+                        labels=list_of_str)
+    section = config.sections['programming_rating']
+
+    # keys are case-insensitive, like in configparser
+    assert section['Competent'] == 1.0
+    section['Novice'] = -1
+    assert section['novice'] == -1.0
+    assert list(section.keys()) == ['competent', 'expert', 'novice']
+
+    section.clear('expert')
+    assert 'expert' not in section.keys()
+    assert section.get('expert', None) is None
+
+    # mutable values are handed out as copies
+    labels = config.sections['labels']
+    labels['john doe'] = list_of_str('VIP')
+    saved = labels['john doe']
+    saved.append('VEGAN')
+    assert labels['john doe'] == ['VIP']
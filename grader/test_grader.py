@@ -1,5 +1,20 @@
-from .grader import Grader
-from .util import our_configfile
+import os
+import re
+
+import numpy as np
+from pytest import mark, raises, skip
+
+from .applications import build_person_factory
+from . import CWD
+from .grader import (
+    Grader,
+    find_min_max,
+    is_vectorizable,
+    rank_applicants,
+    grader_options,
+    rank_person,
+)
+from .util import list_of_float, our_configfile
 
 
 CSV_APPLICATIONS = """
@@ -112,3 +127,306 @@ def test_grader_rank_labels_filter(tmpdir, capsys):
     out, err = capsys.readouterr()
     output_lines = out.replace('-', '').strip().split('\n')[-1:]
     assert 'John Doe' in output_lines[0]
+
+
+def test_grader_formula_compiled_once(tmpdir):
+    config_tmpfile, csv_tmpfile = _tmp_application_files(
+        tmpdir, CONF, CSV_APPLICATIONS)
+    config = our_configfile(config_tmpfile.strpath)
+
+    grader = Grader(
+        identity=1,
+        config=config,
+        applications=[csv_tmpfile.strpath]
+    )
+
+    code = grader.formula_code
+    assert grader.formula_code is code
+
+    grader.formula = '3*nonmale + 1'
+    assert grader.formula_code is not code
+    assert eval(grader.formula_code, {'nonmale': True}) == 4
+
+    # editing the config directly is noticed too
+    config['formula']['formula'] = '2*nonmale'
+    assert eval(grader.formula_code, {'nonmale': True}) == 2
+
+    grader._assign_rankings()
+    assert [p.score for p in grader.applications] == [0, 2]
+
+
+@mark.parametrize('formula, expected', [
+    ('3*female + 1', True),
+    ('(nationality!=affiliation)', True),
+    ('motivation + 0.5*(python - 1) - (applied > 1)', True),
+    ("-(gender == 'F')", True),
+    ('nonmale and python', False),
+    ('not nonmale', False),
+    ('~nonmale + 2', False),
+    ('1 < python < 2', False),
+    ("'VIP' in labels", False),
+    ('max(python, vcs)', False),
+    ('python if nonmale else vcs', False),
+])
+def test_is_vectorizable(formula, expected):
+    assert is_vectorizable(formula) == expected
+
+
+def test_rank_applicants_matches_rank_person():
+    person_factory = build_person_factory(
+        ['name', 'lastname', 'programming', 'open_source', 'python', 'vcs',
+         'underrep', 'born', 'gender', 'nationality', 'affiliation', 'email'])
+    applicants = [
+        person_factory('John', 'Doe', 'competent', 'user', 'expert', 'yes',
+                       'no', '1978', 'Male', 'Italy', 'Italy', 'jd@x.org'),
+        person_factory('Mary', 'Smith', 'expert', 'never used', 'none', 'no',
+                       'yes', '', 'Female', 'Germany', 'UK', 'ms@x.org'),
+    ]
+    ratings = ({'competent': 1.0, 'expert': 0.5},
+               {'user': 0.3, 'never used': 0.0},
+               {'expert': 0.5, 'none': 0.0},
+               {'yes': 1.0, 'no': 0.0},
+               {'yes': 1.0, 'no': 0.0})
+    motivation = [list_of_float([1, None, 0]), list_of_float([None] * 3)]
+    labels = [[], []]
+    applied = [0, 2]
+
+    for formula in ('python + 2*programming + (nationality != affiliation)',
+                    'motivation + vcs - underrep*applied',
+                    "(gender == 'F') + born/1000",
+                    'nonmale and python',
+                    '~nonmale + 2'):
+        expected = [rank_person(p, formula, 'Berlin', *ratings, m, -10, 10, l, a)
+                    for p, m, l, a in zip(applicants, motivation, labels, applied)]
+        scores = rank_applicants(applicants, formula, 'Berlin', *ratings,
+                                 motivation, -10, 10, labels, applied)
+        np.testing.assert_allclose(scores, expected)
+
+
+def test_grader_incremental_ranking(tmpdir):
+    config_tmpfile, csv_tmpfile = _tmp_application_files(
+        tmpdir, CONF, CSV_APPLICATIONS)
+    config = our_configfile(config_tmpfile.strpath)
+
+    grader = Grader(
+        identity=1,
+        config=config,
+        applications=[csv_tmpfile.strpath]
+    )
+    grader.formula = 'motivation + (nationality!=affiliation)'
+    john, mary = grader.applications
+    # what _set_grading does, without the printing
+    section = config['motivation_score-1']
+    section[john.fullname] = 1
+    section[mary.fullname] = -1
+
+    grader._assign_rankings()
+    assert (john.score, john.rank) == (1, 1)
+    assert (mary.score, mary.rank) == (0, 2)
+
+    # only Mary is rescored, John keeps his (fake) score
+    john.score = 42
+    section[mary.fullname] = 1
+    grader._mark_dirty(mary)
+    grader._assign_rankings()
+    assert (mary.score, mary.rank) == (2, 1)
+    assert (john.score, john.rank) == (42, 2)
+
+    # changing a rating rescores everybody
+    grader.config['python_rating']['expert'] = 0.7
+    grader._assign_rankings()
+    assert (john.score, john.rank) == (1, 2)
+    assert (mary.score, mary.rank) == (2, 1)
+
+
+def test_find_min_max():
+    programming = {'novice': 0.0, 'competent': 0.7, 'expert': 0.9}
+    open_source = {'never used': -1.0, 'user': 0.0, 'major contributions': 1.0}
+    python = {'none': 0.0, 'expert': 1.0}
+    vcs = {'yes': 1.0, 'no': 0.0}
+    underrep = {'yes': 1.0, 'no': 0.0}
+    ratings = programming, open_source, python, vcs, underrep
+
+    minsc, maxsc, contr = find_min_max('3*female + 1', 'Berlin', *ratings, [0, 2])
+    assert (minsc, maxsc) == (1, 4)
+    assert list(contr.items()) == [('3*female ', 100), (' 1', 0)]
+
+    formula = ('motivation + programming*python - open_source'
+               ' + (nationality!=affiliation) - applied/2')
+    minsc, maxsc, contr = find_min_max(formula, 'Berlin', *ratings, [0, 1, 2])
+    assert (minsc, maxsc) == (-3, 3.9)
+    assert contr['motivation '] == 2 / 6.9 * 100
+
+    # variables shared between terms are enumerated together
+    minsc, maxsc, contr = find_min_max('python - python + vcs', None, *ratings, [0])
+    assert (minsc, maxsc) == (0, 1)
+
+    minsc, maxsc, contr = find_min_max("'VIP' in labels", None, *ratings, [0])
+    assert np.isnan(minsc) and np.isnan(maxsc)
+
+
+def test_grader_equiv_master(tmpdir):
+    config_tmpfile, csv_tmpfile = _tmp_application_files(
+        tmpdir, CONF, CSV_APPLICATIONS)
+    config = our_configfile(config_tmpfile.strpath)
+
+    grader = Grader(
+        identity=1,
+        config=config,
+        applications=[csv_tmpfile.strpath]
+    )
+    assert grader._equiv_master(' Institute A ') == 'Institute A'
+
+    grader.do_equiv('Institute A = Inst. A = INSTITUTE-A')
+    assert grader._equiv_master('inst. a') == 'institute a'
+    assert grader._equiv_master('Institute-A') == 'institute a'
+    assert grader._equiv_master('Institute A') == 'institute a'
+    assert grader._equiv_master('Institute B') == 'Institute B'
+
+    # the first matching key wins
+    grader.do_equiv('Institute B = Institute A = Inst. B')
+    assert grader._equiv_master('Institute B') == 'institute b'
+    assert grader._equiv_master('Institute A') == 'institute a'
+    assert grader._equiv_master('inst. b') == 'institute b'
+
+
+def test_grader_grading_matrix(tmpdir, monkeypatch):
+    monkeypatch.setattr('grader.grader.printff', lambda *args, **kwargs: None)
+    config_tmpfile, csv_tmpfile = _tmp_application_files(
+        tmpdir, CONF, CSV_APPLICATIONS)
+    config = our_configfile(config_tmpfile.strpath)
+
+    grader = Grader(
+        identity=1,
+        config=config,
+        applications=[csv_tmpfile.strpath]
+    )
+    john, mary = grader.applications
+    config['motivation_score-0']['john doe'] = 1
+    config['motivation_score-2']['john doe'] = float('nan')
+    config['motivation_score-0']['mary jane smith'] = 1
+
+    assert str(grader._gradings(john, 'motivation')) == '1.0, -, nan, -'
+    assert list(grader._disagreement([john, mary], 'motivation')) == [False, False]
+
+    before, _ = grader._grading_matrix('motivation')
+    grader._set_grading(john, 'motivation', -1)
+    grader._set_grading(mary, 'motivation', 0)
+    assert str(grader._gradings(john, 'motivation')) == '1.0, -1.0, nan, -'
+    assert list(grader._disagreement([john, mary], 'motivation')) == [True, False]
+    assert list(grader._disagreement([john, mary], 'motivation', 0)) == [True, False]
+    # the matrix was updated in place, not rebuilt
+    grades, graded = grader._grading_matrix('motivation')
+    assert grades is before
+    assert graded.sum() == 5
+
+    grader.formula = 'motivation'
+    grader._assign_rankings()
+    assert (john.score, mary.score) == (0, 0.5)
+
+
+def test_grader_napplied(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('grader.conf').write(CONF)
+    tmpdir.join('applications.csv').write(CSV_APPLICATIONS)
+    # John applied before, with a differently spelled name,
+    # and another Mary Smith applied too
+    tmpdir.mkdir('2019-somewhere').join('applications.csv').write(
+        CSV_APPLICATIONS.replace('"John","Doe"', '"john","DOE"')
+                        .replace('"Mary Jane"', '"Mary"')
+                        .replace('mary99@gmail.com', 'mary@old.org'))
+    config = our_configfile('grader.conf')
+
+    grader = Grader(
+        identity=1,
+        config=config,
+        applications=['applications.csv', '2019-somewhere/applications.csv']
+    )
+    john, mary = grader.applications
+    assert (john.napplied, mary.napplied) == (1, 0)
+
+
+def test_grader_defer_old(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('grader.conf').write(CONF)
+    tmpdir.join('applications.csv').write(CSV_APPLICATIONS)
+    for edition in ('2018-here', '2019-there'):
+        tmpdir.mkdir(edition).join('applications.csv').write(CSV_APPLICATIONS)
+    config = our_configfile('grader.conf')
+
+    grader = Grader(
+        identity=1,
+        config=config,
+        applications=['applications.csv',
+                      '2018-here/applications.csv',
+                      '2019-there/applications.csv'],
+        defer_old=True,
+    )
+    assert grader._applications_old is None
+    assert grader._applied_range() == [2]
+    assert list(grader.applications_old) == ['2018-here', '2019-there']
+
+
+def test_grader_stat_table(tmpdir, capsys):
+    config_tmpfile, csv_tmpfile = _tmp_application_files(
+        tmpdir, CONF, CSV_APPLICATIONS)
+    config = our_configfile(config_tmpfile.strpath)
+    grader = Grader(identity=1, config=config,
+                    applications=[csv_tmpfile.strpath])
+    capsys.readouterr()
+
+    table = grader.applications.table
+    assert table['nationality'].tolist() == ['Italy', 'Germany']
+    assert table['python_rating'].tolist() == [1.0, 1.0]
+    assert table['open_source_rating'].tolist() == [0.3, 0.5]
+    assert np.isnan(table['score']).all()
+    grader.do_rank(args='')
+    assert not np.isnan(table['score']).any()
+    capsys.readouterr()
+
+    # counting on the columns gives the same as going through the applicants
+    grader._compute_and_print_stats(iter(grader.applications), detailed=True)
+    expected = capsys.readouterr().out
+    grader.do_stat('--detailed')
+    assert capsys.readouterr().out == expected
+
+    grader.do_stat('--label POOR')
+    assert 'Pool                       =     1' in capsys.readouterr().out
+
+
+def test_grader_stat_edition_stream(tmpdir, monkeypatch, capsys):
+    monkeypatch.chdir(tmpdir)
+    tmpdir.join('grader.conf').write(CONF)
+    tmpdir.join('applications.csv').write(CSV_APPLICATIONS)
+    tmpdir.mkdir('2018-here').join('applications.csv').write(CSV_APPLICATIONS)
+    config = our_configfile('grader.conf')
+    grader = Grader(identity=1, config=config,
+                    applications=['applications.csv', '2018-here/applications.csv'],
+                    defer_old=True)
+
+    def stats():
+        grader.do_stat('--detailed --edition 2018-here')
+        out = capsys.readouterr().out
+        return [line for line in out.splitlines() if not line.startswith('loading')]
+
+    streamed = stats()
+    # the edition was read from the file, and not loaded
+    assert grader._applications_old is None
+    assert 'Pool                       =     2' in streamed
+    grader._ensure_old_editions()
+    capsys.readouterr()
+    assert stats() == streamed
+
+def test_grader_revision(monkeypatch, capsys):
+    if not os.path.exists(os.path.join(CWD, os.pardir, '.git')):
+        skip('not a git checkout')
+    import grader
+    monkeypatch.setattr(grader, '_revision_done', False)
+    monkeypatch.setattr(grader, '__revision__', 'N/A')
+    revision = grader.revision()
+    assert re.search('[0-9a-f]{7,40}', revision)
+    assert grader.__revision__ == revision
+
+    with raises(SystemExit):
+        grader_options.parse_args(['--version'])
+    assert capsys.readouterr().out == 'grader 0.1 ({})\n'.format(revision)
@@ -25,6 +25,7 @@ def our_configfile(filename):
         config = configfile.ConfigFile(
             fileobj,
             application_lists=str,
+            csv_dialects=str,
             programming_rating=float,
             open_source_rating=float,
             python_rating=float,
@@ -37,6 +38,8 @@ def our_configfile(filename):
             groups_open_source_rating=float,
             groups_programming_rating=float,
             groups_random_seed=str,
+            groups_apart=float,
+            groups_diversity=float,
             formula=str,
             equivs=list_of_equivs,
             labels=list_of_str,
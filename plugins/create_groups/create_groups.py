@@ -1,6 +1,10 @@
 # This script must be run within grader using the command "loadpy"
 import collections
+import contextlib
 import hashlib
+import itertools
+import multiprocessing
+import os
 import numpy as np
 
 # Here we define how to weight different contributions to the total
@@ -26,6 +30,9 @@ MIN_TRIALS = 5
 MAX_REJECTIONS = 200
 # Relative and absolute tolerance to consider two values of energy equal
 RTOL, ATOL = 0.001, 1e-10
+# Number of processes running trials in parallel (None for one per CPU,
+# 1 to run them here). The result does not depend on it.
+WORKERS = None
 # Output file
 CSV = 'list_groups.csv'
 
@@ -36,6 +43,9 @@ CSV = 'list_groups.csv'
 NSTUDENTS = int(config['formula']['accept_count'])
 # How many students in a group
 GSIZE = config['groups_parameters']['group_size']
+# Optimizer: random swaps (best_swap = 0, the default), or the best
+# of all swaps at every step (best_swap = 1)
+BEST_SWAP = bool(config['groups_parameters'].get('best_swap', 0))
 # Random seed (expected to be a UTF8 string, typically "City YEAR")
 RANDOM_SEED = config['groups_random_seed']['seed']
 
@@ -56,7 +66,7 @@ RANDOM_SEED = bytes(RANDOM_SEED, encoding='utf8')
 # of unsigned 32bit integers. Then sum them up (normalizing by the number
 # of trials to avoid an integer overflow down the road).
 # The result is one nice random seed.
-RANDOM_SEED = np.fromstring(hashlib.sha512(RANDOM_SEED).digest(),
+RANDOM_SEED = np.frombuffer(hashlib.sha512(RANDOM_SEED).digest(),
                             dtype=np.uint32).sum(dtype=np.uint32)
 
 
@@ -97,6 +107,69 @@ def extract_data():
     return people
 
 
+def lab(person):
+    """Return the institute and group of a person, like the grader does"""
+    def canonical(variant):
+        for key, values in config['equivs'].items():
+            if variant.lower() == key.lower() or any(variant.lower() == value.lower()
+                                                    for value in values):
+                return key
+        return variant.strip()
+    if not (person.institute.strip() or person.group.strip()):
+        return None
+    return canonical(person.institute) + ' | ' + canonical(person.group)
+
+
+def extract_conflicts():
+    """Return the hard and soft conflicts between participants.
+
+    The [groups_apart] section says who should be kept apart: 'samelab'
+    for people from the same institute and group, or a label for people
+    sharing it. The value is inf for a hard constraint, otherwise the
+    penalty for each such pair in one group.
+    Returns an array of two students × students matrices.
+    """
+    persons = list(participants())
+    conflicts = np.zeros((2, NSTUDENTS, NSTUDENTS))
+    for criterion, weight in config['groups_apart'].items():
+        if criterion == 'samelab':
+            keys = [lab(person) for person in persons]
+        else:
+            keys = [criterion if any(label.lower() == criterion
+                                     for label in person.labels) else None
+                    for person in persons]
+        known = np.array([key is not None for key in keys])
+        keys = np.array(keys, dtype=object)
+        same = (keys[:, None] == keys[None, :]) & known[:, None]
+        np.fill_diagonal(same, False)
+        if np.isinf(weight):
+            conflicts[0][same] = 1
+        else:
+            conflicts[1] += weight * same
+    return conflicts
+
+
+def extract_categories():
+    """Return the categories of the participants for the diversity terms.
+
+    The [groups_diversity] section gives a weight to attributes like
+    nationality, affiliation or position: the more pairs in a group
+    share a value, the higher the energy.
+    Returns a students × attributes array of integer codes, distinct
+    across attributes, and the array of weights.
+    """
+    weights = dict(config['groups_diversity'].items())
+    persons = list(participants())
+    codes = np.zeros((NSTUDENTS, len(weights)), dtype=int)
+    offset = 0
+    for column, attr in enumerate(weights):
+        values = [getattr(person, attr).strip().lower() for person in persons]
+        _, inverse = np.unique(values, return_inverse=True)
+        codes[:, column] = inverse.reshape(-1) + offset
+        offset += inverse.max() + 1 if len(values) else 0
+    return codes, np.array(list(weights.values()), dtype=float)
+
+
 def name(idx, people):
     """Return a name given an index in the people database"""
     for name, skill in people.items():
@@ -108,16 +181,246 @@ def group(i):
     return slice(i * GSIZE, (i + 1) * GSIZE)
 
 
-def optimize(data, energy, p=REJECTION_PROBABILITY):
+class Groups:
+    """A configuration of students in groups, with its energy kept up to date.
+
+    The energy (see energy below) only depends on the mean skills of each
+    group, and swapping two students changes two of the means. So we keep
+    the per-group sums of the skills, and the sums over the groups of the
+    means and of their squares, from which the standard deviations follow.
+    The energy after a swap is then found in O(skills) instead of going
+    through all the groups twice.
+
+    Conflicts are pairs of students who should not be in the same group,
+    given as two students × students matrices (see extract_conflicts):
+    hard conflicts, each counting more than everything else can change,
+    and soft penalties. For every student we keep the conflicts with the
+    members of every group, so that the change of the conflicts in a swap
+    is found in O(1).
+
+    Categories (see extract_categories) are counted in a groups ×
+    categories matrix, from which the number of pairs sharing a category
+    in a swap follows in O(attributes).
+
+    Students past NGROUPS*GSIZE are in no group and do not count.
+    The data array is modified in place by swap.
+    """
+
+    def __init__(self, data, conflicts=None, categories=None):
+        self.data = data
+        # skill+1 is needed to ignore the idx column in the data
+        self.skills = data[:, 1:].astype(float)
+        # the group at each position, NGROUPS when in no group
+        self.group = np.minimum(np.arange(NSTUDENTS) // GSIZE, NGROUPS)
+        self.counted = self.group < NGROUPS
+        self.sums = np.zeros((NGROUPS + 1, self.skills.shape[1]))
+        np.add.at(self.sums, self.group, self.skills)
+        # measure the means from here, so that the sum of the
+        # squares stays small and precise near convergence
+        self.center = self.sums[:NGROUPS].sum(axis=0) / (NGROUPS * GSIZE)
+        # smaller variances are rounding errors of the updates, which
+        # would make it to the energy magnified by the square root
+        self.tiny = 1e-12 * np.ptp(self.skills, axis=0)**2
+
+        self.student = data[:, 0].astype(int)
+        if conflicts is None:
+            conflicts = np.zeros((2, NSTUDENTS, NSTUDENTS))
+        self.hard, self.soft = conflicts
+        # more than the soft penalties and the skill term can ever change:
+        # the std of the group means of a skill is at most its range
+        self.hard_penalty = (1 + np.abs(self.soft).sum() / 2
+                             + WEIGHTS.dot(np.ptp(self.skills, axis=0)))
+        # [student, group] -> conflicts of student with the members of group
+        members = np.zeros((NSTUDENTS, NGROUPS + 1))
+        members[self.student[self.counted], self.group[self.counted]] = 1
+        self.hard_in = self.hard.dot(members)
+        self.soft_in = self.soft.dot(members)
+        # each pair is seen from both sides
+        self.violations = self.hard_in[self.student, self.group].sum() / 2
+        self.penalty = self.soft_in[self.student, self.group].sum() / 2
+
+        if categories is None:
+            categories = np.zeros((NSTUDENTS, 0), dtype=int), np.zeros(0)
+        codes, self.diversity_weights = categories
+        # the diversity terms are at most their weights
+        self.hard_penalty += np.abs(self.diversity_weights).sum()
+        # the codes at each position
+        self.codes = codes[self.student]
+        # [group, category] -> members of group in category
+        self.counts = np.zeros((NGROUPS + 1, codes.max() + 1 if codes.size else 0))
+        np.add.at(self.counts, (self.group[self.counted, None],
+                                self.codes[self.counted]), 1)
+        # pairs in a group sharing the value of each attribute
+        pairs = self.counts * (self.counts - 1) / 2
+        self.shared = np.array([pairs[:, column].sum() for column in
+                                map(np.unique, self.codes.T)])
+        # normalized by all pairs in groups
+        self.shared_scale = max(NGROUPS * GSIZE * (GSIZE - 1) / 2, 1)
+        self._update()
+
+    def _update(self):
+        means = self.sums[:NGROUPS] / GSIZE - self.center
+        self.sum1 = means.sum(axis=0)
+        self.sum2 = (means**2).sum(axis=0)
+        self.energy = (self._energy(self.sum1, self.sum2) + self.penalty
+                       + self._diversity(self.shared)
+                       + self.hard_penalty * self.violations)
+
+    def _diversity(self, shared):
+        return self.diversity_weights.dot(shared) / self.shared_scale
+
+    def _shared_change(self, a, b):
+        "Return the change of the pairs sharing a category in a swap"
+        ca, cb = self.codes[a], self.codes[b]
+        ga, gb = self.group[a], self.group[b]
+        # a leaves the group of a, b joins it, and vice versa
+        change = np.zeros(len(ca))
+        if self.counted[a]:
+            change += self.counts[ga, cb] - self.counts[ga, ca] + 1
+        if self.counted[b]:
+            change += self.counts[gb, ca] - self.counts[gb, cb] + 1
+        return np.where(ca != cb, change, 0)
+
+    def _conflicts_change(self, conflicts, conflicts_in, a, b):
+        "Return the change of the conflicts between group members in a swap"
+        sa, sb = self.student[a], self.student[b]
+        ga, gb = self.group[a], self.group[b]
+        # a moves to the group of b, without b, and b to the one of a;
+        # students in no group have no conflicts
+        change = -conflicts_in[sa, ga] - conflicts_in[sb, gb]
+        if self.counted[b]:
+            change += conflicts_in[sa, gb] - conflicts[sa, sb]
+        if self.counted[a]:
+            change += conflicts_in[sb, ga] - conflicts[sb, sa]
+        return change
+
+    def swap_violations(self, a, b):
+        """Return the change of the number of hard conflicts in a swap"""
+        if self.group[a] == self.group[b]:
+            return 0
+        return self._conflicts_change(self.hard, self.hard_in, a, b)
+
+    def _energy(self, sum1, sum2):
+        variance = sum2 / NGROUPS - (sum1 / NGROUPS)**2
+        variance[variance <= self.tiny] = 0
+        return WEIGHTS.dot(np.sqrt(variance))
+
+    def swap_energy(self, a, b):
+        """Return the energy after swapping the students at positions a and b"""
+        if self.group[a] == self.group[b]:
+            return self.energy
+        diff = (self.skills[b] - self.skills[a]) / GSIZE
+        sum1, sum2 = self.sum1, self.sum2
+        for g, change in ((self.group[a], diff), (self.group[b], -diff)):
+            if g < NGROUPS:
+                old = self.sums[g] / GSIZE - self.center
+                sum1 = sum1 + change
+                sum2 = sum2 + change * (2 * old + change)
+        penalty = self.penalty + self._conflicts_change(self.soft, self.soft_in, a, b)
+        shared = self.shared + self._shared_change(a, b)
+        violations = self.violations + self.swap_violations(a, b)
+        return (self._energy(sum1, sum2) + penalty + self._diversity(shared)
+                + self.hard_penalty * violations)
+
+    def _conflicts_changes(self, conflicts, conflicts_in):
+        "Return _conflicts_change for all swaps, as a matrix"
+        group, counted = self.group, self.counted
+        pairs = conflicts[np.ix_(self.student, self.student)]
+        # [i, j] -> conflicts of the student at i with the group at j
+        with_group = conflicts_in[self.student][:, group]
+        own = with_group.diagonal()
+        return (counted[None, :] * (with_group - pairs) - own[:, None]
+                + counted[:, None] * (with_group.T - pairs.T) - own[None, :])
+
+    def swap_energies(self):
+        """Return the energies after swapping any two students, as a matrix
+
+        Everything is computed at once with arrays of shape
+        students × students × skills. Swaps within a group, and swaps
+        which add hard conflicts, have infinite energy.
+        """
+        group = self.group
+        counted = self.counted[:, None]
+        means = np.zeros_like(self.sums)
+        means[:NGROUPS] = self.sums[:NGROUPS] / GSIZE - self.center
+        means = means[group]
+        # swapping i and j moves (skill[j] - skill[i]) / GSIZE from
+        # the group of j to the group of i
+        diff = (self.skills[None, :, :] - self.skills[:, None, :]) / GSIZE
+        into_i = counted[:, None, :] * diff
+        out_of_j = counted[None, :, :] * diff
+        sum1 = self.sum1 + into_i - out_of_j
+        sum2 = (self.sum2 + into_i * (2 * means[:, None, :] + diff)
+                          - out_of_j * (2 * means[None, :, :] - diff))
+        variance = sum2 / NGROUPS - (sum1 / NGROUPS)**2
+        variance[variance <= self.tiny] = 0
+        energies = np.sqrt(variance).dot(WEIGHTS)
+        energies += self.penalty + self._conflicts_changes(self.soft, self.soft_in)
+        energies += self._diversity(self.shared)
+        counts = self.counts[group]
+        for codes, weight in zip(self.codes.T, self.diversity_weights):
+            # [i, j] -> members of the group at i in the category of j
+            in_group = counts[:, codes]
+            own = in_group.diagonal()
+            change = (counted * (in_group - own[:, None] + 1)
+                      + counted.T * (in_group.T - own[None, :] + 1))
+            change[codes[:, None] == codes[None, :]] = 0
+            energies += weight * change / self.shared_scale
+        violations = self._conflicts_changes(self.hard, self.hard_in)
+        energies += self.hard_penalty * (self.violations + violations)
+        energies[(group[:, None] == group[None, :]) | (violations > 0)] = np.inf
+        return energies
+
+    def swap(self, a, b):
+        """Swap the students at positions a and b"""
+        ga, gb = self.group[a], self.group[b]
+        if ga == gb:
+            return
+        diff = self.skills[b] - self.skills[a]
+        self.sums[ga] += diff
+        self.sums[gb] -= diff
+        self.penalty += self._conflicts_change(self.soft, self.soft_in, a, b)
+        self.violations += self._conflicts_change(self.hard, self.hard_in, a, b)
+        self.shared += self._shared_change(a, b)
+        ca, cb = self.codes[a], self.codes[b]
+        if ga < NGROUPS:
+            self.counts[ga, ca] -= 1
+            self.counts[ga, cb] += 1
+        if gb < NGROUPS:
+            self.counts[gb, cb] -= 1
+            self.counts[gb, ca] += 1
+        sa, sb = self.student[a], self.student[b]
+        for conflicts_in, conflicts in ((self.hard_in, self.hard),
+                                        (self.soft_in, self.soft)):
+            if ga < NGROUPS:
+                conflicts_in[:, ga] += conflicts[:, sb] - conflicts[:, sa]
+            if gb < NGROUPS:
+                conflicts_in[:, gb] += conflicts[:, sa] - conflicts[:, sb]
+        self.data[[a, b]] = self.data[[b, a]]
+        self.skills[[a, b]] = self.skills[[b, a]]
+        self.student[[a, b]] = self.student[[b, a]]
+        self.codes[[a, b]] = self.codes[[b, a]]
+        # recomputed, and not updated, so that errors do not pile up
+        self._update()
+
+
+def optimize(data, rng, conflicts=None, categories=None, p=REJECTION_PROBABILITY):
     """Minimize energy of a dataset by randomly exchanging two items.
 
     Two items are randomly picked which don't belong to the same group,
     their position is swapped and the change in energy is calculated.
     If the energy is lower afterwards, keep the change, otherwise
     reject the change with a probability p.
-    A function which calculates the energy must be provided."""
+    Changes which add hard conflicts are always rejected, without
+    counting toward MAX_REJECTIONS.
+    Random numbers are taken from the numpy Generator rng.
+    The energy is the one of the energy function below, plus the
+    conflicts and the diversity terms, kept up to date by Groups."""
 
+    groups = Groups(data, conflicts, categories)
     rejected = 0
+    # picks in a row which would add hard conflicts
+    blocked = 0
     count = 0
     p = 1-p
     #for i in range(REPETITIONS):
@@ -127,30 +430,62 @@ def optimize(data, energy, p=REJECTION_PROBABILITY):
         # make sure the two picked ones are not
         # in the same group
         while True:
-            idx = np.random.randint(0, NSTUDENTS, 2)
+            idx = rng.integers(0, NSTUDENTS, 2)
             if idx[0] // GSIZE != idx[1] // GSIZE:
                 break
 
-        E_before = energy(data)
-        data[idx] = data[idx[::-1]]
-        E_after = energy(data)
+        if groups.swap_violations(*idx) > 0:
+            # never put conflicting students together. This is not a
+            # rejection: with many conflicts, most picks are blocked,
+            # and counting them would stop the trials far from a minimum
+            blocked += 1
+            if blocked > MAX_REJECTIONS * NSTUDENTS**2:
+                # about every swap is blocked
+                return count
+            continue
+        blocked = 0
+
+        E_before = groups.energy
+        E_after = groups.swap_energy(*idx)
         # write condition like this to avoid consuming
         # random numbers when p = 1.
-        if E_before < E_after and (p==1 or p > np.random.rand()):
+        if E_before < E_after and (p==1 or p > rng.random()):
             # reject the change
-            data[idx] = data[idx[::-1]]
             rejected += 1
         elif np.isclose(E_before, E_after, rtol=RTOL, atol=ATOL):
             # there was a minimal improvement but let's count it as a rejection
+            groups.swap(*idx)
             rejected += 1
         else:
             # this was a good step, let's reset the rejection counter
+            groups.swap(*idx)
             rejected = 0
         if rejected > MAX_REJECTIONS:
             # we had enough rejections, no point in optimizing further
             return count
 
 
+def optimize_best_swap(data, rng=None, conflicts=None, categories=None):
+    """Minimize energy of a dataset by always making the best exchange.
+
+    All exchanges of two items from different groups are evaluated at
+    once, and the one which lowers the energy most is made, until no
+    exchange lowers it noticeably. The result only depends on the initial
+    condition, rng is accepted for symmetry with optimize."""
+
+    groups = Groups(data, conflicts, categories)
+    count = 0
+    while True:
+        energies = groups.swap_energies()
+        a, b = np.unravel_index(np.argmin(energies), energies.shape)
+        E_before, E_after = groups.energy, energies[a, b]
+        if not E_after < E_before or np.isclose(E_before, E_after, rtol=RTOL, atol=ATOL):
+            # local minimum
+            return count
+        groups.swap(a, b)
+        count += 1
+
+
 def energy_mudeviation(skill):
     """Penalize deviation of a group from the mean over all groups for a certain
     skill."""
@@ -181,45 +516,126 @@ def energy(data):
     return energy
 
 
+def run_trial(in_data, trial, conflicts=None, categories=None):
+    """Optimize from a random initial condition, different for every trial.
+
+    The random numbers of a trial only depend on RANDOM_SEED and on the
+    trial number, so trials can run in any order and in any process.
+    Returns the final energy (with conflicts and diversity), configuration
+    and number of steps.
+    """
+    rng = np.random.default_rng(np.random.SeedSequence([int(RANDOM_SEED), trial]))
+    # IMPORTANT: data gets modified in place in the optimize
+    # function! Do not generate copies here!
+    data = rng.permutation(in_data)
+    optimizer = optimize_best_swap if BEST_SWAP else optimize
+    count = optimizer(data, rng, conflicts, categories)
+    return Groups(data, conflicts, categories).energy, data, count
+
+
+def _trial_worker(conn, in_data, conflicts, categories):
+    """Run the trials received on conn and send back (ok, result or exception)"""
+    for trial in iter(conn.recv, None):
+        try:
+            result = True, run_trial(in_data, trial, conflicts, categories)
+        except Exception as e:
+            result = False, e
+        conn.send(result)
+
+
+def _cpu_count():
+    """Return the number of CPUs this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def run_trials(in_data, conflicts=None, categories=None):
+    """Generator of (trial, energy, data, count) for trials 1, 2, 3, ...
+
+    Trials are run by WORKERS processes, a few trials ahead of the
+    consumer, and the results are returned in order. An exception in a
+    trial is raised here, when its turn comes. The workers are killed,
+    with the trials they are running, when the generator is closed.
+    """
+    workers = WORKERS or _cpu_count()
+    # the workers must be forked: our functions live in the grader
+    # and cannot be sent to a new process
+    if workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        for trial in itertools.count(1):
+            yield (trial,) + run_trial(in_data, trial, conflicts, categories)
+        return
+
+    context = multiprocessing.get_context('fork')
+    pipes, processes = [], []
+    try:
+        for _ in range(workers):
+            here, there = context.Pipe()
+            process = context.Process(target=_trial_worker, daemon=True,
+                                      args=(there, in_data, conflicts, categories))
+            process.start()
+            # so that recv sees the end of the pipe if the worker dies
+            there.close()
+            pipes.append(here)
+            processes.append(process)
+        # worker i runs the trials i+1, i+1+workers, ..., two at a time
+        for trial in range(1, 2 * workers + 1):
+            pipes[(trial - 1) % workers].send(trial)
+        for trial in itertools.count(1):
+            pipe = pipes[(trial - 1) % workers]
+            try:
+                ok, result = pipe.recv()
+            except EOFError:
+                raise RuntimeError('the worker running trial %d died' % trial)
+            if not ok:
+                raise result
+            pipe.send(trial + 2 * workers)
+            yield (trial,) + result
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+
 def main():
     people = extract_data()
     in_data = np.array(list(people.values()))
+    conflicts = extract_conflicts()
+    categories = extract_categories()
     E_trial = []
     data_trial = []
 
-    # set the random seed
-    np.random.seed(RANDOM_SEED)
-
-    # Run several independent trials until we converge to a good solution
+    # Run several independent trials until we converge to a good solution.
+    # They are looked at in order, so the result is the same as if they
+    # were run one after the other.
     print('Running trials...')
-    trial = 0
-    while True:
-        trial += 1
-        # create different initial condition for every trial
-        #np.random.seed(np.uint32(trial) * RANDOM_SEED)
-        # IMPORTANT: data gets modified in place in the optimize
-        # function! Do not generate copies here!
-        data = np.random.permutation(in_data)
-        count = optimize(data, energy)
-        # final energy
-        E = energy(data)
-        # store the final energy of the trial
-        E_trial.append(E)
-        # store the final configuration of the trial
-        data_trial.append(data)
-        # give a bit of a progress report
-        print('Trial #%d(%d):'%(trial, count), E)
-        # collect a minimum of trials
-        if trial < MIN_TRIALS: continue
-
-        # if we did not improve much in this last step, we converged
-        E_min = min(E_trial[:-1])
-        if E <= E_min and np.isclose(E, E_min, rtol=RTOL, atol=ATOL):
-            best_trial = np.argmin(E_trial)
-            best = data_trial[best_trial]
-            print('Converged! Best trial #%d,'%(best_trial+1),
-                  'Energy:', E_trial[best_trial])
-            break
+    with contextlib.closing(run_trials(in_data, conflicts, categories)) as trials:
+        for trial, E, data, count in trials:
+            # store the final energy of the trial
+            E_trial.append(E)
+            # store the final configuration of the trial
+            data_trial.append(data)
+            # give a bit of a progress report
+            print('Trial #%d(%d):'%(trial, count), E)
+            # collect a minimum of trials
+            if trial < MIN_TRIALS: continue
+
+            # if we did not improve much in this last step, we converged
+            E_min = min(E_trial[:-1])
+            if E <= E_min and np.isclose(E, E_min, rtol=RTOL, atol=ATOL):
+                best_trial = np.argmin(E_trial)
+                best = data_trial[best_trial]
+                print('Converged! Best trial #%d,'%(best_trial+1),
+                      'Energy:', E_trial[best_trial])
+                break
+
+    final = Groups(best, conflicts, categories)
+    if final.violations:
+        print('Could not keep apart %d pairs, see [groups_apart]' % final.violations)
+    if final.shared.size:
+        print('Pairs sharing', ', '.join(config['groups_diversity'].keys())+':',
+              final.shared.astype(int))
 
     # calculate optimal skill distribution: that is the average over all students
     opt_skills = in_data.mean(axis=0)[1:]
@@ -0,0 +1,142 @@
+import os
+import types
+
+import numpy as np
+from pytest import approx
+
+PLUGIN = os.path.join(os.path.dirname(__file__), 'create_groups.py')
+
+LEVELS = {
+    'gender': ['male', 'female'],
+    'python': ['none', 'novice', 'competent', 'expert'],
+    'programming': ['novice', 'competent', 'expert'],
+    'vcs': ['yes', 'no'],
+    'open_source': ['never', 'user', 'contributor'],
+}
+
+
+def make_applications(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return types.SimpleNamespace(applicants=[
+        types.SimpleNamespace(
+            fullname='Person {}'.format(i),
+            labels=['CONFIRMED'] + (['RICH'] if i % 3 == 0 else []),
+            institute='Institute {}'.format(i % 5),
+            group='Group {}'.format(i % 2),
+            nationality='Country {}'.format(rng.integers(4)),
+            **{skill: str(rng.choice(levels)) for skill, levels in LEVELS.items()})
+        for i in range(count)])
+
+
+def make_config(count, group_size, apart=(), diversity=()):
+    config = {
+        'formula': {'accept_count': count},
+        'groups_parameters': {'group_size': group_size},
+        'groups_random_seed': {'seed': 'Somewhere 2020'},
+        'equivs': {},
+        'groups_apart': dict(apart),
+        'groups_diversity': dict(diversity),
+    }
+    for skill, levels in LEVELS.items():
+        config['groups_{}_rating'.format(skill)] = {
+            level: i / (len(levels) - 1) for i, level in enumerate(levels)}
+    return config
+
+
+def load_plugin(count=14, group_size=4, apart=(), diversity=()):
+    """Return the namespace of the plugin, without running main()"""
+    with open(PLUGIN) as file:
+        source, call, _ = file.read().rpartition('\nmain()')
+    assert call
+    namespace = {'config': make_config(count, group_size, apart, diversity),
+                 'applications': make_applications(count)}
+    exec(compile(source, PLUGIN, 'exec'), namespace)
+    return namespace
+
+
+def initial_data(plugin, seed=1):
+    in_data = np.array(list(plugin['extract_data']().values()))
+    return np.random.default_rng(seed).permutation(in_data)
+
+
+def random_swaps(plugin, count, seed=2):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        a, b = rng.integers(0, plugin['NSTUDENTS'], 2)
+        yield a, b
+
+
+def same_lab(i, j):
+    # see make_applications
+    return i != j and i % 5 == j % 5 and i % 2 == j % 2
+
+
+def test_groups_energy_after_swaps():
+    # two students are in no group
+    plugin = load_plugin(count=14, group_size=4)
+    data = initial_data(plugin)
+    groups = plugin['Groups'](data)
+    assert groups.energy == approx(plugin['energy'](data))
+    for a, b in random_swaps(plugin, 200):
+        expected = groups.swap_energy(a, b)
+        groups.swap(a, b)
+        assert groups.energy == approx(expected)
+        assert groups.energy == approx(plugin['energy'](data), abs=1e-9)
+
+
+def test_groups_swap_energies():
+    plugin = load_plugin(count=14, group_size=4)
+    groups = plugin['Groups'](initial_data(plugin))
+    for a, b in random_swaps(plugin, 20):
+        groups.swap(a, b)
+        energies = groups.swap_energies()
+        for i in range(plugin['NSTUDENTS']):
+            for j in range(plugin['NSTUDENTS']):
+                if groups.group[i] == groups.group[j]:
+                    assert energies[i, j] == np.inf
+                else:
+                    assert energies[i, j] == approx(groups.swap_energy(i, j))
+
+
+def test_extract_conflicts():
+    plugin = load_plugin(count=14, group_size=4,
+                         apart=[('samelab', np.inf), ('rich', 0.5)])
+    hard, soft = plugin['extract_conflicts']()
+    for i in range(14):
+        for j in range(14):
+            assert hard[i, j] == same_lab(i, j)
+            assert soft[i, j] == (0.5 if i != j and i % 3 == j % 3 == 0 else 0)
+
+
+def test_groups_conflicts_after_swaps():
+    plugin = load_plugin(count=14, group_size=4,
+                         apart=[('samelab', np.inf), ('rich', 0.5)])
+    conflicts = plugin['extract_conflicts']()
+    data = initial_data(plugin)
+    groups = plugin['Groups'](data, conflicts)
+    for a, b in random_swaps(plugin, 200):
+        expected = groups.swap_energy(a, b)
+        groups.swap(a, b)
+        assert groups.energy == approx(expected)
+        fresh = plugin['Groups'](data.copy(), conflicts)
+        assert groups.violations == fresh.violations
+        assert groups.penalty == approx(fresh.penalty)
+        assert groups.energy == approx(fresh.energy)
+        # pairs of students in a group, in a recount
+        members = [data[plugin['group'](i), 0] for i in range(plugin['NGROUPS'])]
+        pairs = [(i, j) for group in members for i in group for j in group if i < j]
+        assert groups.violations == sum(same_lab(i, j) for i, j in pairs)
+        assert groups.penalty == approx(sum(0.5 for i, j in pairs if i % 3 == j % 3 == 0))
+
+
+def test_hard_conflicts_kept_apart():
+    plugin = load_plugin(count=14, group_size=4, apart=[('samelab', np.inf)])
+    in_data = np.array(list(plugin['extract_data']().values()))
+    conflicts = plugin['extract_conflicts']()
+    for best_swap in False, True:
+        plugin['BEST_SWAP'] = best_swap
+        for trial in range(1, 6):
+            E, data, count = plugin['run_trial'](in_data, trial, conflicts)
+            for i in range(plugin['NGROUPS']):
+                members = data[plugin['group'](i), 0]
+                assert not any(same_lab(a, b) for a in members for b in members)